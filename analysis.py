@@ -0,0 +1,534 @@
+import ast
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from pygments.token import Token
+from pygments.util import ClassNotFound
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Shown when a category has no findings, matching what the UI used to display
+EMPTY_FINDINGS = {
+    'bugs': 'No syntax errors found',
+    'quality': 'Code follows standard conventions',
+    'performance': 'No obvious performance issues',
+    'security': 'No security vulnerabilities detected'
+}
+
+MAX_FUNCTION_LINES = 50
+MAX_PARAMETERS = 5
+MAX_NESTING = 4
+MAX_LINE_LENGTH = 120
+
+SECRET_NAME_PATTERN = re.compile(r'(password|passwd|secret|api_?key|token|private_?key)', re.IGNORECASE)
+
+class AnalysisLimitExceeded(Exception):
+    pass
+
+class AnalysisTimeout(AnalysisLimitExceeded):
+    pass
+
+def new_report():
+    return {'bugs': [], 'quality': [], 'performance': [], 'security': [], 'parameters': [], 'signatures': [], 'examples': ''}
+
+def finish_report(report):
+    for field, message in EMPTY_FINDINGS.items():
+        # Several nodes can trigger the same finding; keep the first occurrence of each
+        report[field] = list(dict.fromkeys(report[field])) or [message]
+    return report
+
+# Python: checks on the syntax tree
+
+def call_name(node):
+    # 'os.system' for os.system(...), 'eval' for eval(...)
+    func = node.func
+    parts = []
+    while isinstance(func, ast.Attribute):
+        parts.append(func.attr)
+        func = func.value
+    if isinstance(func, ast.Name):
+        parts.append(func.id)
+    return '.'.join(reversed(parts))
+
+def keyword_value(node, name):
+    for keyword in node.keywords:
+        if keyword.arg == name:
+            return keyword.value
+    return None
+
+def is_constant(node, value):
+    return isinstance(node, ast.Constant) and node.value is value
+
+def loop_depth(node):
+    deepest = 0
+    for child in ast.iter_child_nodes(node):
+        deepest = max(deepest, loop_depth(child))
+    return deepest + 1 if isinstance(node, (ast.For, ast.While, ast.AsyncFor)) else deepest
+
+def nesting_depth(node):
+    deepest = 0
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        deepest = max(deepest, nesting_depth(child))
+    blocks = (ast.If, ast.For, ast.While, ast.With, ast.Try, ast.AsyncFor, ast.AsyncWith)
+    return deepest + 1 if isinstance(node, blocks) else deepest
+
+def check_python_call(node, report):
+    name = call_name(node)
+    line = node.lineno
+    if name in ('eval', 'exec'):
+        report['security'].append(f"Line {line}: {name}() runs arbitrary code; avoid it on untrusted input")
+    elif name in ('os.system', 'os.popen'):
+        report['security'].append(f"Line {line}: {name}() goes through the shell; use subprocess with an argument list")
+    elif name.startswith('subprocess.') and is_constant(keyword_value(node, 'shell'), True):
+        report['security'].append(f"Line {line}: {name}(shell=True) is open to shell injection")
+    elif name in ('pickle.loads', 'pickle.load', 'marshal.loads', 'marshal.load'):
+        report['security'].append(f"Line {line}: {name}() can execute code from untrusted data")
+    elif name == 'yaml.load' and keyword_value(node, 'Loader') is None:
+        report['security'].append(f"Line {line}: yaml.load() without a Loader; use yaml.safe_load()")
+    elif name in ('hashlib.md5', 'hashlib.sha1'):
+        report['security'].append(f"Line {line}: {name.split('.')[1]} is not collision resistant; use sha256 or better")
+    elif name == 'tempfile.mktemp':
+        report['security'].append(f"Line {line}: tempfile.mktemp() is racy; use mkstemp() or NamedTemporaryFile()")
+    elif name.startswith('requests.') and is_constant(keyword_value(node, 'verify'), False):
+        report['security'].append(f"Line {line}: TLS certificate verification is disabled")
+
+def check_python_function(node, report):
+    args = node.args
+    line = node.lineno
+    for default in args.defaults + [d for d in args.kw_defaults if d is not None]:
+        if isinstance(default, (ast.List, ast.Dict, ast.Set)):
+            report['bugs'].append(f"Line {line}: {node.name}() has a mutable default argument shared between calls")
+    count = len(args.posonlyargs) + len(args.args) + len(args.kwonlyargs)
+    if args.args and args.args[0].arg in ('self', 'cls'):
+        count -= 1
+    if count > MAX_PARAMETERS:
+        report['quality'].append(f"Line {line}: {node.name}() takes {count} parameters; consider grouping them")
+    length = (node.end_lineno or line) - line + 1
+    if length > MAX_FUNCTION_LINES:
+        report['quality'].append(f"Line {line}: {node.name}() is {length} lines long; consider splitting it up")
+    if not node.name.startswith('_') and ast.get_docstring(node) is None:
+        report['quality'].append(f"Line {line}: {node.name}() has no docstring")
+    depth = nesting_depth(node)
+    if depth > MAX_NESTING:
+        report['quality'].append(f"Line {line}: {node.name}() nests blocks {depth} levels deep")
+
+def check_unreachable(node, report):
+    for field in ('body', 'orelse', 'finalbody'):
+        statements = getattr(node, field, None)
+        if not isinstance(statements, list):
+            continue
+        for index, statement in enumerate(statements[:-1]):
+            if isinstance(statement, (ast.Return, ast.Raise, ast.Break, ast.Continue)):
+                following = statements[index + 1]
+                report['bugs'].append(f"Line {following.lineno}: unreachable code after {type(statement).__name__.lower()}")
+                break
+
+def check_python_loop(node, report, string_names):
+    line = node.lineno
+    if isinstance(node, ast.For) and isinstance(node.iter, ast.Call):
+        name = call_name(node.iter)
+        if name == 'range' and len(node.iter.args) == 1 and isinstance(node.iter.args[0], ast.Call) \
+                and call_name(node.iter.args[0]) == 'len':
+            report['performance'].append(f"Line {line}: range(len(...)) loop; iterate directly or use enumerate()")
+        elif name.endswith('.keys') and not node.iter.args:
+            report['performance'].append(f"Line {line}: iterating over .keys() builds a view needlessly; iterate the dict")
+    depth = loop_depth(node)
+    if depth >= 3:
+        report['performance'].append(f"Line {line}: loops nested {depth} deep; check the algorithmic complexity")
+    for child in ast.walk(node):
+        if isinstance(child, ast.AugAssign) and isinstance(child.op, ast.Add) \
+                and isinstance(child.target, ast.Name) and child.target.id in string_names:
+            report['performance'].append(
+                f"Line {child.lineno}: string concatenation in a loop; collect parts and use ''.join()")
+
+def python_signature(node):
+    prefix = 'async def' if isinstance(node, ast.AsyncFunctionDef) else 'def'
+    signature = f"{prefix} {node.name}({ast.unparse(node.args)})"
+    if node.returns is not None:
+        signature += f" -> {ast.unparse(node.returns)}"
+    return signature
+
+def python_parameters(node):
+    args = node.args
+    positional = args.posonlyargs + args.args
+    defaults = [None] * (len(positional) - len(args.defaults)) + args.defaults
+    pairs = list(zip(positional, defaults)) + list(zip(args.kwonlyargs, args.kw_defaults))
+    if args.vararg:
+        pairs.append((args.vararg, None))
+    if args.kwarg:
+        pairs.append((args.kwarg, None))
+    parameters = []
+    for arg, default in pairs:
+        if arg.arg in ('self', 'cls'):
+            continue
+        description = f"Parameter of {node.name}()"
+        if arg is args.vararg:
+            description = f"Extra positional arguments of {node.name}()"
+        elif arg is args.kwarg:
+            description = f"Extra keyword arguments of {node.name}()"
+        if default is not None:
+            description += f", defaults to {ast.unparse(default)}"
+        parameters.append({
+            'name': arg.arg,
+            'description': description,
+            'type': ast.unparse(arg.annotation) if arg.annotation is not None else ''
+        })
+    return parameters
+
+def python_example(functions):
+    public = [node for node in functions if not node.name.startswith('_')]
+    if not public:
+        return ''
+    node = public[0]
+    arguments = [arg.arg for arg in node.args.posonlyargs + node.args.args if arg.arg not in ('self', 'cls')]
+    required = arguments[:len(arguments) - len(node.args.defaults)] if node.args.defaults else arguments
+    call = f"{node.name}({', '.join(required)})"
+    if isinstance(node, ast.AsyncFunctionDef):
+        call = f"await {call}"
+    return f"Example usage:\nresult = {call}\nprint(result)"
+
+def analyze_python(code):
+    report = new_report()
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        report['bugs'].append(f"Syntax error on line {e.lineno}: {e.msg}")
+        return report
+
+    imported = {}
+    used_names = set()
+    string_names = set()
+    functions = []
+    for node in ast.walk(tree):
+        check_unreachable(node, report)
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == '*':
+                    report['quality'].append(f"Line {node.lineno}: wildcard import from {node.module}")
+                else:
+                    imported.setdefault((alias.asname or alias.name).split('.')[0], node.lineno)
+        elif isinstance(node, ast.Name):
+            used_names.add(node.id)
+        elif isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    string_names.add(target.id)
+                    if node.value.value and SECRET_NAME_PATTERN.search(target.id):
+                        report['security'].append(f"Line {node.lineno}: {target.id} looks like a hardcoded secret")
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            functions.append(node)
+            check_python_function(node, report)
+        elif isinstance(node, ast.ExceptHandler) and node.type is None:
+            report['bugs'].append(f"Line {node.lineno}: bare except also catches KeyboardInterrupt and SystemExit")
+        elif isinstance(node, ast.Compare):
+            for op, comparator in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.Eq, ast.NotEq)) and is_constant(comparator, None):
+                    report['bugs'].append(f"Line {node.lineno}: compare with None using 'is' / 'is not'")
+                elif isinstance(op, (ast.Is, ast.IsNot)) and isinstance(comparator, ast.Constant) \
+                        and comparator.value is not None and not isinstance(comparator.value, bool):
+                    report['bugs'].append(f"Line {node.lineno}: 'is' compares identity, not value, for literals")
+        elif isinstance(node, ast.Assert) and isinstance(node.test, ast.Tuple):
+            report['bugs'].append(f"Line {node.lineno}: assert on a tuple is always true")
+        elif isinstance(node, ast.Call):
+            check_python_call(node, report)
+        elif isinstance(node, (ast.For, ast.While, ast.AsyncFor)):
+            check_python_loop(node, report, string_names)
+
+    seen = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if node.name in seen:
+                report['bugs'].append(f"Line {node.lineno}: {node.name}() redefines the function from line {seen[node.name]}")
+            seen[node.name] = node.lineno
+
+    # Attribute chains (os.path) and re-exports in __all__ also count as uses
+    used_names.update(
+        node.value for node in ast.walk(tree) if isinstance(node, ast.Constant) and isinstance(node.value, str))
+    for name, line in imported.items():
+        if name not in used_names:
+            report['quality'].append(f"Line {line}: '{name}' is imported but never used")
+
+    for node in functions:
+        report['signatures'].append(python_signature(node))
+        report['parameters'].extend(python_parameters(node))
+    report['examples'] = python_example(functions)
+    return report
+
+# Other languages: token-level checks on the pygments token stream
+
+DANGEROUS_CALLS = {
+    'eval': 'eval() runs arbitrary code',
+    'exec': 'exec() runs arbitrary commands',
+    'system': 'system() goes through the shell',
+    'popen': 'popen() goes through the shell',
+    'shell_exec': 'shell_exec() goes through the shell',
+    'gets': 'gets() cannot bound its input; use fgets()',
+    'strcpy': 'strcpy() does not check the destination size',
+    'strcat': 'strcat() does not check the destination size',
+    'sprintf': 'sprintf() does not check the destination size; use snprintf()',
+    'innerHTML': 'innerHTML with dynamic content is open to XSS',
+    'unsafe': 'unsafe block bypasses the borrow checker'
+}
+
+LOOP_KEYWORDS = {'for', 'while', 'foreach', 'loop', 'do'}
+BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+def get_lexer(language, code):
+    # pygments.lexers loads its whole lexer map, so it is imported on first use instead of at startup
+    from pygments.lexers import get_lexer_by_name, guess_lexer
+    try:
+        # startinline lets the PHP lexer handle snippets without an opening <?php tag
+        return get_lexer_by_name(language or '', startinline=True)
+    except ClassNotFound:
+        return guess_lexer(code)
+
+FUNCTION_KEYWORDS = {'function', 'func', 'fn', 'def', 'sub'}
+
+def split_parameters(tokens, start):
+    # Token chunks between the '(' at `start` and its matching ')', split on top-level commas
+    chunks, chunk, depth = [], [], 0
+    for kind, value in tokens[start + 1:]:
+        if value in ('(', '[', '<'):
+            depth += 1
+        elif value in (')', ']', '>'):
+            if depth == 0 and value == ')':
+                break
+            depth -= 1
+        if value == ',' and depth == 0:
+            chunks.append(chunk)
+            chunk = []
+        else:
+            chunk.append((kind, value))
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def token_parameters(tokens, language):
+    # Collects parameters of declarations like `name(type a, type b)` from the token stream
+    parameters = []
+    signatures = []
+    positions = [index for index, (kind, value) in enumerate(tokens) if kind not in Token.Text and value.strip()]
+    for position, index in enumerate(positions):
+        kind, value = tokens[index]
+        if kind not in Token.Name or position + 1 >= len(positions) or tokens[positions[position + 1]][1] != '(':
+            continue
+        previous = tokens[positions[position - 1]][1] if position else ''
+        if kind not in Token.Name.Function and previous not in FUNCTION_KEYWORDS:
+            continue
+        names = []
+        for chunk in split_parameters(tokens, positions[position + 1]):
+            values = [chunk_value for chunk_kind, chunk_value in chunk if chunk_kind not in Token.Comment]
+            words = [word for word in values if word.strip()]
+            if not words:
+                continue
+            if ':' in words:
+                split = values.index(':')
+                name, param_type = ''.join(values[:split]), ''.join(values[split + 1:])
+            elif language == 'go':
+                name, param_type = words[0], ''.join(values[values.index(words[0]) + 1:])
+            else:
+                name_at = len(values) - 1 - values[::-1].index(words[-1])
+                name, param_type = words[-1], ''.join(values[:name_at])
+            name = name.strip().lstrip('$&*')
+            if not re.match(r'^\w+$', name):
+                continue
+            names.append(name)
+            parameters.append({'name': name, 'description': f"Parameter of {value}()", 'type': param_type.strip()})
+        signatures.append(f"{value}({', '.join(names)})")
+    return parameters, signatures
+
+def analyze_tokens(code, language):
+    report = new_report()
+    lexer = get_lexer(language, code)
+    tokens = list(lexer.get_tokens(code))
+
+    line = 1
+    stack = []
+    block_stack = []
+    pending_loop = False
+    deepest_loops = 0
+    for kind, value in tokens:
+        if kind in Token.Error:
+            report['bugs'].append(f"Line {line}: unexpected character {value.strip()!r}")
+        elif kind in Token.Comment and re.search(r'\b(TODO|FIXME|XXX)\b', value):
+            report['quality'].append(f"Line {line}: unresolved {re.search(r'TODO|FIXME|XXX', value).group()} comment")
+        elif kind in Token.Keyword and value in LOOP_KEYWORDS:
+            pending_loop = True
+        elif kind in Token.Name:
+            message = DANGEROUS_CALLS.get(value)
+            if message:
+                report['security'].append(f"Line {line}: {message}")
+            elif SECRET_NAME_PATTERN.search(value) and value.isupper():
+                report['security'].append(f"Line {line}: {value} may be a hardcoded secret")
+        elif kind in Token.Punctuation or kind in Token.Operator:
+            for char in value:
+                if char in '([{':
+                    stack.append((char, line))
+                    if char == '{':
+                        block_stack.append(pending_loop)
+                        pending_loop = False
+                        deepest_loops = max(deepest_loops, sum(block_stack))
+                elif char in BRACKETS:
+                    if not stack or stack[-1][0] != BRACKETS[char]:
+                        report['bugs'].append(f"Line {line}: unmatched '{char}'")
+                        continue
+                    stack.pop()
+                    if char == '}' and block_stack:
+                        block_stack.pop()
+        line += value.count('\n')
+
+    for char, opened in stack:
+        report['bugs'].append(f"Line {opened}: '{char}' is never closed")
+    if deepest_loops >= 3:
+        report['performance'].append(f"Loops nested {deepest_loops} deep; check the algorithmic complexity")
+    for number, text in enumerate(code.splitlines(), 1):
+        if len(text) > MAX_LINE_LENGTH:
+            report['quality'].append(f"Line {number}: line is {len(text)} characters long")
+
+    report['parameters'], report['signatures'] = token_parameters(tokens, language)
+    if report['signatures']:
+        report['examples'] = f"Example usage:\n{report['signatures'][0]}"
+    return report
+
+def analyze(code, language):
+    if (language or '').lower() in ('python', 'py', 'python3'):
+        report = analyze_python(code)
+    else:
+        report = analyze_tokens(code, language)
+    return finish_report(report)
+
+# Worker-process side: each job runs under its own CPU budget
+
+def raise_analysis_timeout(signum, frame):
+    raise AnalysisTimeout('Analysis exceeded its CPU time limit')
+
+# resource and SIGXCPU are POSIX-only, so they are imported here rather than with the module
+
+def address_space_size(resource):
+    # Only Linux reports the current size, through /proc; macOS and the BSDs have no /proc to read
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return None
+
+def init_worker(memory_limit):
+    import resource
+    import signal
+
+    signal.signal(signal.SIGXCPU, raise_analysis_timeout)
+    current = address_space_size(resource) if memory_limit else None
+    if current is not None:
+        # A forked worker inherits the parent's address space, so the limit is headroom on top of it
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = current + memory_limit
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def run_limited(code, language, cpu_limit):
+    import resource
+
+    # RLIMIT_CPU counts the whole process, so the budget is set relative to what it has already used
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    budget = used + cpu_limit
+    if hard != resource.RLIM_INFINITY:
+        budget = min(budget, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (budget, hard))
+    try:
+        return analyze(code, language)
+    except MemoryError:
+        raise AnalysisLimitExceeded('Analysis exceeded its memory limit')
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def content_key(code, language):
+    return hashlib.sha256(f"{(language or '').lower()}\x1f{code}".encode('utf-8')).hexdigest()
+
+class AnalysisPool:
+    # Runs analyses in worker processes so a pathological input can't hold a web worker or the GIL.
+    # workers=0 analyses inline, without limits, for platforms that can't fork; that is also the
+    # fallback where POSIX resource limits aren't available (Windows).
+    def __init__(self, workers=2, cpu_limit=5, timeout=10, memory_limit=512 * 1024 * 1024, cache_size=512):
+        if workers and os.name != 'posix':
+            logger.warning('Analysis resource limits need a POSIX platform; analysing inline instead')
+            workers = 0
+        if workers and memory_limit and not os.path.exists('/proc/self/statm'):
+            logger.warning('No /proc/self/statm to measure workers against; analysing without a memory limit')
+        self.workers = workers
+        self.cpu_limit = cpu_limit
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.cache = LRUCache(max_entries=cache_size)
+        self.stats = {'analyses': 0, 'cache_hits': 0, 'timeouts': 0, 'pool_restarts': 0}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Always fork, as the memory limit assumes: spawn and forkserver (the defaults on macOS
+                # and on newer Pythons) would re-run the app's entry module in every worker
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('fork'),
+                    initializer=init_worker, initargs=(self.memory_limit,))
+            return self._executor
+
+    def start(self):
+        # Forks every worker now rather than on the first analysis. A child only inherits the thread
+        # that forked it, so call this before the app starts threads whose locks it could copy held.
+        # A pool replaced after a worker dies is forked from the running process.
+        if self.workers:
+            self._get_executor().submit(os.getpid).result()
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.stats['pool_restarts'] += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def analyze(self, code, language):
+        key = content_key(code, language)
+        report = self.cache.get(key)
+        if report is not None:
+            self.stats['cache_hits'] += 1
+            return report
+
+        self.stats['analyses'] += 1
+        if not self.workers:
+            report = analyze(code, language)
+        else:
+            executor = self._get_executor()
+            try:
+                report = executor.submit(run_limited, code, language, self.cpu_limit).result(timeout=self.timeout)
+            except FutureTimeoutError:
+                # The worker keeps going until its CPU budget runs out, which frees it shortly after
+                self.stats['timeouts'] += 1
+                raise AnalysisTimeout(f"Analysis took longer than {self.timeout}s")
+            except BrokenProcessPool:
+                logger.error('Analysis worker died; restarting the pool')
+                self._reset(executor)
+                raise
+        self.cache.set(key, report)
+        return report
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            # Waits for the workers to exit, at most a running job's CPU budget. Left running, they
+            # kept an eventlet process from exiting when it shut down right after starting them.
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -1,40 +1,172 @@
-from flask import Flask, render_template, request, jsonify, session
+import time
+
+# Cold-start accounting: imports, module setup and startup() (schema migrations included) are
+# timed, logged once and exported as app_startup_seconds
+STARTUP_STARTED = time.perf_counter()
+
+from flask import Flask, Response, g, render_template, request, jsonify, session
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
+import atexit
+import functools
 import logging
 import uuid
 import json
-import requests
+import queue
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
+import shortuuid
 from database import (
-    init_db, save_snippet, get_snippets, get_snippet,
-    save_generation_history, get_generation_history,
+    init_db, close_pool, save_snippet, get_snippet,
+    save_generation_history, get_generation_history_item,
+    get_generation_history_page, get_snippets_page, search_code,
     create_collaboration_session, get_collaboration_session,
-    update_collaboration_code, save_collaboration_message,
+    save_collaboration_message,
     get_collaboration_messages, end_collaboration_session,
     save_shared_code, get_shared_code
 )
+import logs
+import metrics
+from openrouter_client import OpenRouterClient
+from cache import GenerationCache, SingleFlight, generation_cache_key
+from collaboration import (
+    CollaborationWriteBuffer, DocumentRegistry, InvalidOperation, RedisDocumentStore,
+    SharedDocumentRegistry, StaleRevision
+)
+from analysis import AnalysisLimitExceeded, AnalysisPool
+from highlighting import HighlightCache, content_hash, highlight_css, themes
+from jobs import LocalJobQueue, QueueFull, RedisJobQueue
+from maintenance import MaintenanceSweeper
+from presence import EventAggregator, LocalPresenceStore, PresenceTracker, RedisPresenceStore
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+startup_timings = {'imports': time.perf_counter() - STARTUP_STARTED}
 
 # Load environment variables
 load_dotenv()
 
+# Static analysis runs in worker processes with a per-job CPU budget; results are cached by content hash.
+# startup() forks the workers before it starts any thread.
+analysis_pool = AnalysisPool(
+    workers=int(os.getenv('ANALYSIS_WORKERS', '2')),
+    cpu_limit=int(os.getenv('ANALYSIS_CPU_LIMIT', '5')),
+    timeout=float(os.getenv('ANALYSIS_TIMEOUT', '10')),
+    memory_limit=int(os.getenv('ANALYSIS_MEMORY_MB', '512')) * 1024 * 1024,
+    cache_size=int(os.getenv('ANALYSIS_CACHE_SIZE', '512'))
+)
+
+logger = logging.getLogger(__name__)
+metrics.callback('log_records_dropped_total', 'Log records dropped because the log queue was full',
+                 lambda: {(): logs.dropped()}, kind='counter')
+
 # OpenRouter API configuration
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
-
-def generate_code_with_ai(prompt, language):
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "HTTP-Referer": "http://localhost:5005",
-        "X-Title": "Code Generation IDE",
-        "Content-Type": "application/json"
-    }
-    
+OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+OPENROUTER_MODEL = os.getenv('OPENROUTER_MODEL', 'google/gemini-pro')
+OPENROUTER_TIMEOUT = float(os.getenv('OPENROUTER_TIMEOUT', '60'))
+
+# Pooled keep-alive client with retries and a circuit breaker shared by every completion call
+openrouter = OpenRouterClient(
+    OPENROUTER_API_URL, OPENROUTER_API_KEY,
+    pool_size=int(os.getenv('OPENROUTER_POOL_SIZE', '20')),
+    connect_timeout=float(os.getenv('OPENROUTER_CONNECT_TIMEOUT', '5')),
+    read_timeout=OPENROUTER_TIMEOUT,
+    max_retries=int(os.getenv('OPENROUTER_MAX_RETRIES', '3')),
+    backoff_base=float(os.getenv('OPENROUTER_BACKOFF_BASE', '0.5')),
+    backoff_max=float(os.getenv('OPENROUTER_BACKOFF_MAX', '8')),
+    breaker_threshold=int(os.getenv('OPENROUTER_BREAKER_THRESHOLD', '5')),
+    breaker_reset_timeout=float(os.getenv('OPENROUTER_BREAKER_RESET', '30'))
+)
+
+metrics.callback(
+    'openrouter_calls_total', 'OpenRouter client calls by outcome: attempts, retries, error responses, '
+    'failures after retries and calls rejected by the open circuit breaker',
+    lambda: {(outcome,): count for outcome, count in openrouter.get_stats().items() if outcome != 'circuit'},
+    ['outcome'], kind='counter')
+metrics.callback('openrouter_circuit_open', '1 while the OpenRouter circuit breaker is open',
+                 lambda: {(): int(openrouter.breaker.state == 'open')})
+
+# Where /generate time goes: one timer per OpenRouter call in the pipeline, plus the tokens
+# each call reports in its usage block
+stage_seconds = metrics.histogram(
+    'generation_stage_duration_seconds', 'Time spent in each OpenRouter call of the generation pipeline', ['stage'])
+upstream_tokens = metrics.counter(
+    'openrouter_tokens_total', 'Tokens reported by OpenRouter usage blocks', ['stage', 'direction'])
+
+def record_usage(stage, usage):
+    if not isinstance(usage, dict):
+        return
+    upstream_tokens.inc(stage, 'in', amount=usage.get('prompt_tokens') or 0)
+    upstream_tokens.inc(stage, 'out', amount=usage.get('completion_tokens') or 0)
+
+# 'multi' asks for code, explanation and future steps in three calls; 'single' asks for all three at once
+GENERATION_MODE = os.getenv('GENERATION_MODE', 'multi')
+GENERATION_MODES = ('multi', 'single')
+
+# Explanation and future steps only depend on the generated code, so they can run side by side
+OPENROUTER_CONCURRENT_FOLLOWUPS = os.getenv('OPENROUTER_CONCURRENT_FOLLOWUPS', '1') == '1'
+# Seconds a pair of concurrent follow-ups gets, retries and backoff included, before it is degraded
+OPENROUTER_FOLLOWUP_DEADLINE = float(os.getenv('OPENROUTER_FOLLOWUP_DEADLINE', str(OPENROUTER_TIMEOUT)))
+followup_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('OPENROUTER_FOLLOWUP_WORKERS', '8')),
+    thread_name_prefix='openrouter-followup'
+)
+# Streamed follow-ups hold a worker for as long as the client reads, so they get their own pool
+# (two workers per concurrent stream) and can't starve the follow-ups of queued generation jobs
+stream_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('OPENROUTER_STREAM_WORKERS', '32')),
+    thread_name_prefix='openrouter-stream'
+)
+
+# Prompt -> result cache so repeated prompts skip OpenRouter entirely
+generation_cache = GenerationCache(
+    ttl=int(os.getenv('GENERATION_CACHE_TTL', '86400')),
+    max_entries=int(os.getenv('GENERATION_CACHE_SIZE', '1024')),
+    max_persistent_entries=int(os.getenv('GENERATION_CACHE_DB_SIZE', '10000')),
+    persistent=os.getenv('GENERATION_CACHE_PERSISTENT', '1') == '1'
+)
+GENERATION_CACHE_ENABLED = os.getenv('GENERATION_CACHE_ENABLED', '1') == '1'
+
+# Identical prompts arriving together (a whole class hitting "Generate") share one upstream pipeline
+generation_flights = SingleFlight()
+
+def is_cacheable(explanation, future_steps):
+    # Degraded follow-ups should be retried next time rather than served from cache
+    return not any(text.startswith('Error: Could not') for text in (explanation, future_steps))
+
+def request_followup(data, label, fallback, deadline=None):
+    stage = fallback.replace(' ', '_')
+    try:
+        with stage_seconds.time(stage):
+            response = openrouter.chat_completion(data, deadline=deadline)
+        if not response.ok:
+            logger.error(f"OpenRouter API Error ({label}): {response.status_code} - {logs.truncate(response.text)}")
+            return f"Error: Could not generate {fallback}"
+
+        result = response.json()
+        record_usage(stage, result.get('usage'))
+        logs.log_payload(logger, f"OpenRouter API {label} response", result)
+        if 'choices' in result:
+            return result['choices'][0]['message']['content']
+        return result.get('response', f"Error: Could not parse {fallback} response")
+    except Exception as e:
+        logger.error(f"OpenRouter API Error ({label}): {str(e)}")
+        return f"Error: Could not generate {fallback}"
+
+def collect_followup(future, label, fallback, deadline):
+    try:
+        # The call itself gives up by the deadline; the headroom covers reading the body and the hand-off
+        return future.result(timeout=max(0, deadline - time.monotonic()) + 5)
+    except FutureTimeoutError:
+        # Still queued: cancel() keeps it from starting. A running call ends at the deadline.
+        future.cancel()
+        logger.error(f"OpenRouter API Error ({label}): timed out after {OPENROUTER_FOLLOWUP_DEADLINE}s")
+        return f"Error: Could not generate {fallback}"
+
+def build_code_request(prompt, language):
     # Enhanced prompt with emphasis on correctness and testing
     system_prompt = f"""You are an expert programmer focused on generating accurate, tested code in {language}.
     Follow these guidelines strictly:
@@ -58,8 +190,8 @@ def generate_code_with_ai(prompt, language):
     3. Verify the output is correct
     4. Only then provide the final, tested code"""
     
-    data = {
-        "model": "google/gemini-pro",
+    return {
+        "model": OPENROUTER_MODEL,
         "messages": [
             {
                 "role": "system",
@@ -71,58 +203,15 @@ def generate_code_with_ai(prompt, language):
             }
         ]
     }
-    
-    try:
-        logger.debug(f"Sending request to OpenRouter with data: {json.dumps(data, indent=2)}")
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=data)
-        
-        if not response.ok:
-            error_text = response.text
-            try:
-                error_json = response.json()
-                if 'error' in error_json and isinstance(error_json['error'], dict):
-                    error_text = error_json['error'].get('message', error_text)
-            except:
-                pass
-            logger.error(f"OpenRouter API Error: {response.status_code} - {error_text}")
-            raise Exception(f"OpenRouter API Error: {error_text}")
-            
-        result = response.json()
-        logger.debug(f"OpenRouter API Response: {json.dumps(result, indent=2)}")
-        
-        if 'error' in result:
-            error_message = result['error'].get('message', 'Unknown error')
-            raise Exception(f"OpenRouter API Error: {error_message}")
-        
-        # Extract the generated code from the response
-        if isinstance(result, dict):
-            if 'choices' in result and len(result['choices']) > 0:
-                message = result['choices'][0].get('message', {})
-                if isinstance(message, dict) and 'content' in message:
-                    generated_code = message['content']
-            elif 'response' in result:
-                generated_code = result['response']
-            else:
-                for key in result.keys():
-                    logger.debug(f"Found key in response: {key}")
-                raise Exception(f"Unexpected API response format. Keys found: {', '.join(result.keys())}")
-        else:
-            raise Exception(f"Unexpected API response type: {type(result)}")
-        
-        if not generated_code:
-            raise Exception("No code was generated in the response")
-            
-        # Clean up the code by removing markdown code blocks if present
-        if generated_code.startswith('```') and generated_code.endswith('```'):
-            generated_code = '\n'.join(generated_code.split('\n')[1:-1])
-        
-        # Generate explanation with enhanced focus on correctness
-        explanation_data = {
-            "model": "google/gemini-pro",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": f"""Explain in detail how this {language} code works, focusing on:
+
+def build_explanation_request(generated_code, language):
+    # Generate explanation with enhanced focus on correctness
+    return {
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": f"""Explain in detail how this {language} code works, focusing on:
                     1. The correctness of the implementation
                     2. How it handles edge cases
                     3. Any potential limitations or assumptions
@@ -130,29 +219,18 @@ def generate_code_with_ai(prompt, language):
                     
                     Code:
                     {generated_code}"""
-                }
-            ]
-        }
-        
-        explanation_response = requests.post(OPENROUTER_API_URL, headers=headers, json=explanation_data)
-        if not explanation_response.ok:
-            logger.error(f"OpenRouter API Error (Explanation): {explanation_response.status_code} - {explanation_response.text}")
-            explanation = "Error: Could not generate explanation"
-        else:
-            explanation_result = explanation_response.json()
-            logger.debug(f"OpenRouter API Explanation Response: {json.dumps(explanation_result, indent=2)}")
-            if 'choices' in explanation_result:
-                explanation = explanation_result['choices'][0]['message']['content']
-            else:
-                explanation = explanation_result.get('response', "Error: Could not parse explanation response")
-        
-        # Generate future steps with focus on improvements and testing
-        future_steps_data = {
-            "model": "google/gemini-pro",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": f"""What are the next steps to improve this {language} code? Consider:
+            }
+        ]
+    }
+
+def build_future_steps_request(generated_code, language):
+    # Generate future steps with focus on improvements and testing
+    return {
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": f"""What are the next steps to improve this {language} code? Consider:
                     1. Additional test cases needed
                     2. Edge cases that should be handled
                     3. Performance optimizations
@@ -161,45 +239,465 @@ def generate_code_with_ai(prompt, language):
                     
                     Code:
                     {generated_code}"""
-                }
-            ]
-        }
+            }
+        ]
+    }
+
+def clean_generated_code(generated_code):
+    # Clean up the code by removing markdown code blocks if present
+    if generated_code.startswith('```') and generated_code.endswith('```'):
+        generated_code = '\n'.join(generated_code.split('\n')[1:-1])
+    return generated_code
+
+def build_structured_request(prompt, language):
+    # Single-call mode: ask for code, explanation and next steps in one completion
+    data = build_code_request(prompt, language)
+    data["messages"][0]["content"] += f"""
+    
+    Format your whole answer as exactly three sections, each starting with its marker on its own line:
+    {STRUCTURED_MARKERS['code']}
+    (only the final {language} code, no markdown fences)
+    {STRUCTURED_MARKERS['explanation']}
+    (a detailed explanation of how the code works, its correctness, edge cases, limitations and expected output)
+    {STRUCTURED_MARKERS['future_steps']}
+    (next steps to improve the code: tests, edge cases, performance, error handling, organization)"""
+    return data
+
+STRUCTURED_MARKERS = {
+    'code': '===CODE===',
+    'explanation': '===EXPLANATION===',
+    'future_steps': '===FUTURE_STEPS==='
+}
+STRUCTURED_PATTERN = re.compile(
+    r'^\s*(' + '|'.join(re.escape(marker) for marker in STRUCTURED_MARKERS.values()) + r')\s*$',
+    re.MULTILINE
+)
+
+def parse_structured_response(content):
+    # Returns {'code', 'explanation', 'future_steps'} for whichever sections were found
+    parts = STRUCTURED_PATTERN.split(content or '')
+    names = {marker: name for name, marker in STRUCTURED_MARKERS.items()}
+    sections = {}
+    for marker, text in zip(parts[1::2], parts[2::2]):
+        text = text.strip()
+        if text:
+            sections[names[marker]] = text
+    if 'code' in sections:
+        sections['code'] = clean_generated_code(sections['code'])
+    return sections
+
+def generate_code_with_ai(prompt, language, mode=None):
+    # A request that names its mode is measuring that pipeline, so it skips cached results
+    # (its own result is still stored) and only joins in-flight calls running the same mode
+    if GENERATION_CACHE_ENABLED and mode is None:
+        cached = generation_cache.get(prompt, language, OPENROUTER_MODEL)
+        if cached is not None:
+            logger.debug("Generation cache hit for prompt: %s, language: %s", logs.payload(prompt), language)
+            return cached
+
+    mode = mode or GENERATION_MODE
+    key = f"{generation_cache_key(prompt, language, OPENROUTER_MODEL)}:{mode}"
+    return generation_flights.do(key, generate_and_cache, prompt, language, mode)
+
+def generate_and_cache(prompt, language, mode=None):
+    generated_code, explanation, future_steps = run_generation_pipeline(prompt, language, mode)
+
+    if GENERATION_CACHE_ENABLED and is_cacheable(explanation, future_steps):
+        generation_cache.set(prompt, language, OPENROUTER_MODEL, (generated_code, explanation, future_steps))
+    return generated_code, explanation, future_steps
+
+def request_completion(data, stage='code'):
+    logs.log_payload(logger, 'Sending request to OpenRouter', data)
+    with stage_seconds.time(stage):
+        response = openrouter.chat_completion(data)
+    
+    if not response.ok:
+        error_text = response.text
+        try:
+            error_json = response.json()
+            if 'error' in error_json and isinstance(error_json['error'], dict):
+                error_text = error_json['error'].get('message', error_text)
+        except:
+            pass
+        logger.error(f"OpenRouter API Error: {response.status_code} - {logs.truncate(error_text)}")
+        raise Exception(f"OpenRouter API Error: {error_text}")
         
-        future_steps_response = requests.post(OPENROUTER_API_URL, headers=headers, json=future_steps_data)
-        if not future_steps_response.ok:
-            logger.error(f"OpenRouter API Error (Future Steps): {future_steps_response.status_code} - {future_steps_response.text}")
-            future_steps = "Error: Could not generate future steps"
+    result = response.json()
+    logs.log_payload(logger, 'OpenRouter API response', result)
+    if isinstance(result, dict):
+        record_usage(stage, result.get('usage'))
+    
+    if 'error' in result:
+        error_message = result['error'].get('message', 'Unknown error')
+        raise Exception(f"OpenRouter API Error: {error_message}")
+    
+    # Extract the generated content from the response
+    content = None
+    if isinstance(result, dict):
+        if 'choices' in result and len(result['choices']) > 0:
+            message = result['choices'][0].get('message', {})
+            if isinstance(message, dict) and 'content' in message:
+                content = message['content']
+        elif 'response' in result:
+            content = result['response']
         else:
-            future_steps_result = future_steps_response.json()
-            logger.debug(f"OpenRouter API Future Steps Response: {json.dumps(future_steps_result, indent=2)}")
-            if 'choices' in future_steps_result:
-                future_steps = future_steps_result['choices'][0]['message']['content']
-            else:
-                future_steps = future_steps_result.get('response', "Error: Could not parse future steps response")
+            for key in result.keys():
+                logger.debug(f"Found key in response: {key}")
+            raise Exception(f"Unexpected API response format. Keys found: {', '.join(result.keys())}")
+    else:
+        raise Exception(f"Unexpected API response type: {type(result)}")
+    
+    if not content:
+        raise Exception("No code was generated in the response")
+    return content
+
+def request_followups(generated_code, language):
+    explanation_data = build_explanation_request(generated_code, language)
+    future_steps_data = build_future_steps_request(generated_code, language)
+    
+    if OPENROUTER_CONCURRENT_FOLLOWUPS:
+        deadline = time.monotonic() + OPENROUTER_FOLLOWUP_DEADLINE
+        explanation_future = followup_executor.submit(
+            logs.carry(request_followup), explanation_data, 'Explanation', 'explanation', deadline)
+        future_steps_future = followup_executor.submit(
+            logs.carry(request_followup), future_steps_data, 'Future Steps', 'future steps', deadline)
+        explanation = collect_followup(explanation_future, 'Explanation', 'explanation', deadline)
+        future_steps = collect_followup(future_steps_future, 'Future Steps', 'future steps', deadline)
+    else:
+        explanation = request_followup(explanation_data, 'Explanation', 'explanation')
+        future_steps = request_followup(future_steps_data, 'Future Steps', 'future steps')
+    return explanation, future_steps
+
+def run_generation_pipeline(prompt, language, mode=None):
+    mode = mode or GENERATION_MODE
+    
+    try:
+        if mode == 'single':
+            try:
+                sections = parse_structured_response(
+                    request_completion(build_structured_request(prompt, language), stage='structured'))
+            except Exception as e:
+                logger.error(f"Single-call generation failed, falling back to three calls: {str(e)}")
+                sections = {}
+            
+            if 'code' in sections:
+                if 'explanation' in sections and 'future_steps' in sections:
+                    return sections['code'], sections['explanation'], sections['future_steps']
+                # The code section parsed, so only the missing follow-ups need another round-trip
+                logger.warning("Structured response was missing sections, requesting follow-ups separately")
+                if 'explanation' in sections or 'future_steps' in sections:
+                    explanation = sections.get('explanation') or request_followup(
+                        build_explanation_request(sections['code'], language), 'Explanation', 'explanation')
+                    future_steps = sections.get('future_steps') or request_followup(
+                        build_future_steps_request(sections['code'], language), 'Future Steps', 'future steps')
+                else:
+                    explanation, future_steps = request_followups(sections['code'], language)
+                return sections['code'], explanation, future_steps
+            logger.warning("Could not parse structured response, falling back to three calls")
         
+        generated_code = clean_generated_code(request_completion(build_code_request(prompt, language)))
+        explanation, future_steps = request_followups(generated_code, language)
         return generated_code, explanation, future_steps
         
     except Exception as e:
         logger.error(f"Error generating code with AI: {str(e)}")
         raise
 
-import pusher
+def stream_completion(data, stage='code'):
+    # Yields content deltas from an OpenRouter completion requested with stream: true
+    payload = dict(data, stream=True)
+    with stage_seconds.time(stage), openrouter.chat_completion(payload, stream=True) as response:
+        if not response.ok:
+            raise Exception(f"OpenRouter API Error: {response.status_code} - {response.text}")
+        
+        for line in response.iter_lines(decode_unicode=True):
+            # OpenRouter sends ": OPENROUTER PROCESSING" comments as keep-alives
+            if not line or not line.startswith('data:'):
+                continue
+            chunk = line[len('data:'):].strip()
+            if chunk == '[DONE]':
+                break
+            
+            event = json.loads(chunk)
+            if 'error' in event:
+                raise Exception(f"OpenRouter API Error: {event['error'].get('message', 'Unknown error')}")
+            # The final chunk carries the usage block
+            record_usage(stage, event.get('usage'))
+            choices = event.get('choices') or []
+            if choices:
+                delta = choices[0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
 
-pusher_client = pusher.Pusher(
-    app_id=os.getenv('PUSHER_APP_ID'),
-    key=os.getenv('PUSHER_KEY'),
-    secret=os.getenv('PUSHER_SECRET'),
-    cluster=os.getenv('PUSHER_CLUSTER'),
-    ssl=True
-)
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def stream_followup(updates, field, data, fallback, cancelled):
+    # Stops reading, and closes the upstream response, once the client has gone away
+    if cancelled.is_set():
+        return
+    parts = []
+    deltas = stream_completion(data, stage=fallback.replace(' ', '_'))
+    try:
+        for delta in deltas:
+            if cancelled.is_set():
+                logger.info(f"Client disconnected, cancelled {field} stream")
+                return
+            parts.append(delta)
+            updates.put(('delta', field, delta))
+        text = ''.join(parts)
+    except Exception as e:
+        logger.error(f"OpenRouter API Error ({field} stream): {str(e)}")
+        text = f"Error: Could not generate {fallback}"
+    finally:
+        deltas.close()
+    updates.put(('done', field, text))
+
+@functools.lru_cache(maxsize=None)
+def get_pusher_client():
+    # Built on the first publish: importing pusher (and its crypto dependencies) is a noticeable
+    # share of a cold start, and most requests never publish
+    import pusher
+
+    return pusher.Pusher(
+        app_id=os.getenv('PUSHER_APP_ID'),
+        key=os.getenv('PUSHER_KEY'),
+        secret=os.getenv('PUSHER_SECRET'),
+        cluster=os.getenv('PUSHER_CLUSTER'),
+        ssl=True
+    )
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your-secret-key')
-socketio = SocketIO(app)
 
-init_db()
+# Latency per route template (not per URL, to keep label cardinality bounded). Streamed
+# responses are timed until the server closes their body, after the last chunk is sent.
+http_request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route', ['method', 'route', 'status'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Correlation ids on every log line a request produces. A well-formed X-Request-ID from a proxy is
+# kept so lines can be matched across services; it is echoed back on the response.
+REQUEST_ID_PATTERN = re.compile(r'^[\w.-]{1,64}$')
+
+@app.before_request
+def bind_log_context():
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else logs.new_id()
+    view_args = request.view_args or {}
+    logs.set_ids(request_id=g.request_id, room=view_args.get('room_id') or view_args.get('session_id'))
+
+@app.after_request
+def add_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        labels = (request.method, route, str(response.status_code))
+        if response.is_streamed:
+            # after_request runs before a streamed body is generated
+            response.call_on_close(lambda: http_request_seconds.observe(time.perf_counter() - started, *labels))
+        else:
+            http_request_seconds.observe(time.perf_counter() - started, *labels)
+    return response
+# Multi-process mode: with a message queue (e.g. redis://localhost:6379/0) emits reach clients on every
+# worker, and room presence and documents live in Redis. The load balancer must keep each socket on one worker.
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+COLLAB_REDIS_URL = os.getenv('COLLAB_REDIS_URL', SOCKETIO_MESSAGE_QUEUE)
+COLLAB_PRESENCE_TTL = int(os.getenv('COLLAB_PRESENCE_TTL', '60'))
+COLLAB_PRESENCE_HEARTBEAT = float(os.getenv('COLLAB_PRESENCE_HEARTBEAT', '20'))
+COLLAB_OP_HISTORY = int(os.getenv('COLLAB_OP_HISTORY', '500'))
 
-active_sessions = {}
+# server.py switches this to eventlet or gevent after monkey patching; left to auto-detection,
+# Flask-SocketIO would pick eventlet whenever it is installed, patched or not
+socketio = SocketIO(app, message_queue=SOCKETIO_MESSAGE_QUEUE, async_mode=os.getenv('SOCKETIO_ASYNC_MODE', 'threading'))
+
+socket_events = metrics.counter('socketio_events_total', 'Socket.IO events received, by event', ['event'])
+socket_event_seconds = metrics.histogram(
+    'socketio_event_duration_seconds', 'Time spent in Socket.IO event handlers', ['event'])
+
+def socket_event(event):
+    # socketio.on() that also counts and times the handler
+    def register(handler):
+        @functools.wraps(handler)
+        def instrumented(*args):
+            # Log lines carry the socket id and the room: named by join_session, and remembered in the
+            # socket's session for every event after it
+            data = args[0] if args and isinstance(args[0], dict) else {}
+            logs.set_ids(request_id=request.sid, room=data.get('session_id') or session.get('session_id'))
+            ensure_started()
+            socket_events.inc(event)
+            with socket_event_seconds.time(event):
+                return handler(*args)
+        return socketio.on(event)(instrumented)
+    return register
+
+# Collaborative edits are buffered in memory and persisted in batches instead of one write per keystroke
+collab_writes = CollaborationWriteBuffer(
+    interval=float(os.getenv('COLLAB_FLUSH_INTERVAL', '1')),
+    idle_flush=float(os.getenv('COLLAB_IDLE_FLUSH', '2')),
+    max_delay=float(os.getenv('COLLAB_MAX_UNFLUSHED', '10'))
+)
+
+# Expired shares, ended sessions and old chat are pruned in the background instead of piling up
+maintenance = MaintenanceSweeper(
+    interval=float(os.getenv('MAINTENANCE_INTERVAL', '3600')),
+    delay=float(os.getenv('MAINTENANCE_INITIAL_DELAY', '60')),
+    session_retention=int(os.getenv('COLLAB_SESSION_RETENTION', str(7 * 86400))),
+    message_retention=int(os.getenv('COLLAB_MESSAGE_RETENTION', str(30 * 86400))),
+    vacuum_pages=int(os.getenv('MAINTENANCE_VACUUM_PAGES', '1000')),
+    batch_size=int(os.getenv('MAINTENANCE_BATCH_SIZE', '500'))
+)
+MAINTENANCE_ENABLED = os.getenv('MAINTENANCE_ENABLED', '1') == '1'
+
+# Authoritative document per room; edits arrive as transformed ops and snapshots go through collab_writes.
+# In multi-process mode revisions are ordered through a shared op log instead of a single process.
+if COLLAB_REDIS_URL:
+    import redis
+
+    collab_redis = redis.Redis.from_url(COLLAB_REDIS_URL, decode_responses=True)
+    collab_documents = SharedDocumentRegistry(
+        RedisDocumentStore(
+            collab_redis,
+            history_limit=COLLAB_OP_HISTORY,
+            snapshot_every=int(os.getenv('COLLAB_SNAPSHOT_EVERY', '50')),
+            ttl=int(os.getenv('COLLAB_STATE_TTL', '86400'))
+        ),
+        history_limit=COLLAB_OP_HISTORY
+    )
+    presence_store = RedisPresenceStore(collab_redis, ttl=COLLAB_PRESENCE_TTL)
+else:
+    collab_documents = DocumentRegistry(history_limit=COLLAB_OP_HISTORY)
+    presence_store = LocalPresenceStore(ttl=COLLAB_PRESENCE_TTL)
+
+presence = PresenceTracker(presence_store, interval=COLLAB_PRESENCE_HEARTBEAT)
+
+# Gauges read at scrape time from state the app already keeps
+metrics.callback('socketio_connections', 'Sockets in a collaboration room on this worker',
+                 lambda: {(): presence.stats()['connections']})
+metrics.callback('socketio_rooms', 'Collaboration rooms with a socket on this worker',
+                 lambda: {(): presence.stats()['rooms']})
+metrics.callback('socketio_participants', 'Collaboration participants with a socket on this worker',
+                 lambda: {(): presence.stats()['participants']})
+
+# Pusher accepts at most this many events per trigger_batch call, and rejects events whose data is
+# larger than PUSHER_EVENT_SIZE_LIMIT bytes (10KB on the standard plans)
+PUSHER_BATCH_LIMIT = 10
+PUSHER_EVENT_SIZE_LIMIT = int(os.getenv('PUSHER_EVENT_SIZE_LIMIT', '10240'))
+
+def publish_room_activity(batches):
+    for session_id, payload in batches.items():
+        socketio.emit('room_activity', payload, room=session_id)
+
+def publish_pusher_updates(batches):
+    # One oversized document would fail the whole trigger_batch call, so rooms over the size limit
+    # are sent on their own and only that room's update is lost if Pusher rejects it
+    events, oversized = [], []
+    for room_id, payload in batches.items():
+        event = {'channel': f'room-{room_id}', 'name': 'room-update', 'data': payload}
+        size = len(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        (oversized if size > PUSHER_EVENT_SIZE_LIMIT else events).append(event)
+    # Every chunk and oversized event is attempted even if an earlier one fails; failures are raised together
+    failed = 0
+    for start in range(0, len(events), PUSHER_BATCH_LIMIT):
+        chunk = events[start:start + PUSHER_BATCH_LIMIT]
+        try:
+            get_pusher_client().trigger_batch(chunk)
+        except Exception as e:
+            failed += len(chunk)
+            logger.error(f"Error publishing {len(chunk)} batched room updates: {str(e)}")
+    for event in oversized:
+        try:
+            get_pusher_client().trigger(event['channel'], event['name'], event['data'])
+        except Exception as e:
+            failed += 1
+            logger.error(f"Error publishing oversized update to {event['channel']}: {str(e)}")
+    if failed:
+        raise Exception(f"{failed} of {len(batches)} room updates were rejected")
+
+# Typing indicators and cursors are coalesced per room instead of broadcast on every keystroke;
+# Pusher updates are also sent off the request thread
+room_events = EventAggregator(
+    publish_room_activity, window=float(os.getenv('COLLAB_EVENT_WINDOW', '0.1')), name='room-activity')
+pusher_updates = EventAggregator(
+    publish_pusher_updates, window=float(os.getenv('PUSHER_EVENT_WINDOW', '0.25')), name='pusher-updates')
+
+def run_generation_job(payload):
+    # Worker log lines carry the id of the request that queued the job
+    logs.set_ids(request_id=payload.get('request_id'), room=None)
+    prompt, language, mode = payload['prompt'], payload['language'], payload.get('mode')
+    generated_code, explanation, future_steps = generate_code_with_ai(prompt, language, mode)
+    history_id = save_generation_history(prompt, generated_code, language, explanation, future_steps)
+    return {
+        'code': generated_code,
+        'explanation': explanation,
+        'futureSteps': future_steps,
+        'historyId': history_id
+    }
+
+def public_job(job):
+    fields = {
+        'jobId': job['id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+    if job['result'] is not None:
+        fields['result'] = job['result']
+    if job['error'] is not None:
+        fields['error'] = job['error']
+    return fields
+
+def announce_generation_job(job):
+    socketio.emit('generation_complete', public_job(job), room=f"job-{job['id']}")
+
+# Generation runs on a bounded worker pool so slow pipelines don't tie up web workers.
+# GENERATION_QUEUE_URL (redis://...) shares one queue across processes; otherwise it is in-process.
+GENERATION_QUEUE_URL = os.getenv('GENERATION_QUEUE_URL')
+GENERATION_JOB_RETRY_AFTER = os.getenv('GENERATION_JOB_RETRY_AFTER', '5')
+generation_job_options = {
+    'workers': int(os.getenv('GENERATION_WORKERS', '4')),
+    'max_depth': int(os.getenv('GENERATION_QUEUE_MAX', '100')),
+    'per_user_limit': int(os.getenv('GENERATION_USER_CONCURRENCY', '2')),
+    'result_ttl': int(os.getenv('GENERATION_JOB_TTL', '3600')),
+    'on_complete': announce_generation_job
+}
+if GENERATION_QUEUE_URL:
+    import redis
+
+    generation_jobs = RedisJobQueue(
+        redis.Redis.from_url(GENERATION_QUEUE_URL, decode_responses=True), run_generation_job, **generation_job_options)
+else:
+    generation_jobs = LocalJobQueue(run_generation_job, **generation_job_options)
+
+metrics.callback('generation_jobs_queued', 'Generation jobs waiting for a worker',
+                 lambda: {(): generation_jobs.stats()['queued']})
+
+def job_owner():
+    # Browsers are identified by their session cookie; clients that don't keep cookies share a limit per address
+    owner = session.get('client_id')
+    if owner is None:
+        session['client_id'] = uuid.uuid4().hex
+        owner = session['client_id'] if request.cookies else request.remote_addr
+    return owner
+
+def load_collaboration_state(session_id, collab_session):
+    # Unflushed edits are newer than what the database has
+    pending = collab_writes.get(session_id)
+    if pending:
+        return pending
+    if collab_session:
+        return collab_session.get('code') or '', collab_session.get('language') or 'python'
+    return '', 'python'
 
 @app.route('/')
 def home():
@@ -215,46 +713,187 @@ def generate_code():
         data = request.get_json()
         prompt = data.get('prompt', '')
         language = data.get('language', 'python')
+        mode = data.get('mode')
         
-        logger.debug(f"Generating code for prompt: {prompt}, language: {language}")
+        if mode is not None and mode not in GENERATION_MODES:
+            return jsonify({'error': f"Unknown generation mode: {mode}"}), 400
         
-        generated_code, explanation, future_steps = generate_code_with_ai(prompt, language)
+        logger.debug("Queueing generation for prompt: %s, language: %s, mode: %s",
+                     logs.payload(prompt), language, mode or GENERATION_MODE)
         
-        save_generation_history(prompt, generated_code, language, explanation, future_steps)
+        try:
+            job = generation_jobs.submit(job_owner(), {
+                'prompt': prompt, 'language': language, 'mode': mode, 'request_id': logs.request_id.get()
+            })
+        except QueueFull as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = GENERATION_JOB_RETRY_AFTER
+            return response, 429
+        
+        # Poll the status URL or emit 'watch_job' over SocketIO to receive 'generation_complete'
+        response = jsonify(dict(public_job(job), statusUrl=f"/generate/{job['id']}"))
+        response.headers['Location'] = f"/generate/{job['id']}"
+        return response, 202
+    except Exception as e:
+        logger.error(f"Error generating code: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-        return jsonify({
+@app.route('/generate/<job_id>', methods=['GET'])
+def get_generation_job(job_id):
+    try:
+        job = generation_jobs.get(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(public_job(job))
+    except Exception as e:
+        logger.error(f"Error fetching generation job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_code_stream():
+    data = request.get_json()
+    prompt = data.get('prompt', '')
+    language = data.get('language', 'python')
+
+    logger.debug("Streaming code for prompt: %s, language: %s", logs.payload(prompt), language)
+
+    def events():
+        cached = generation_cache.get(prompt, language, OPENROUTER_MODEL) if GENERATION_CACHE_ENABLED else None
+        if cached is not None:
+            generated_code, explanation, future_steps = cached
+            save_generation_history(prompt, generated_code, language, explanation, future_steps)
+            yield sse_event('code_done', {'code': generated_code})
+            yield sse_event('explanation_done', {'explanation': explanation})
+            yield sse_event('futureSteps_done', {'futureSteps': future_steps})
+            yield sse_event('done', {
+                'code': generated_code,
+                'explanation': explanation,
+                'futureSteps': future_steps,
+                'message': 'Code generated successfully'
+            })
+            return
+
+        try:
+            code_parts = []
+            for delta in stream_completion(build_code_request(prompt, language)):
+                code_parts.append(delta)
+                yield sse_event('code', {'delta': delta})
+
+            generated_code = clean_generated_code(''.join(code_parts))
+            if not generated_code:
+                raise Exception("No code was generated in the response")
+            yield sse_event('code_done', {'code': generated_code})
+        except Exception as e:
+            logger.error(f"Error streaming code: {str(e)}")
+            yield sse_event('error', {'error': str(e)})
+            return
+
+        # Explanation and future steps stream side by side and are interleaved as they arrive
+        updates = queue.Queue()
+        results = {
+            'explanation': "Error: Could not generate explanation",
+            'futureSteps': "Error: Could not generate future steps"
+        }
+        cancelled = threading.Event()
+        stream_executor.submit(logs.carry(stream_followup), updates, 'explanation',
+                               build_explanation_request(generated_code, language), 'explanation', cancelled)
+        stream_executor.submit(logs.carry(stream_followup), updates, 'futureSteps',
+                               build_future_steps_request(generated_code, language), 'future steps', cancelled)
+
+        # The finally also runs when the server closes this generator because the client disconnected
+        try:
+            pending = set(results)
+            while pending:
+                try:
+                    kind, field, text = updates.get(timeout=OPENROUTER_TIMEOUT)
+                except queue.Empty:
+                    logger.error(f"Timed out waiting for streamed fields: {', '.join(sorted(pending))}")
+                    break
+                if kind == 'delta':
+                    yield sse_event(field, {'delta': text})
+                else:
+                    results[field] = text
+                    pending.discard(field)
+                    yield sse_event(f'{field}_done', {field: text})
+        finally:
+            cancelled.set()
+
+        try:
+            save_generation_history(prompt, generated_code, language, results['explanation'], results['futureSteps'])
+        except Exception as e:
+            logger.error(f"Error saving streamed generation: {str(e)}")
+
+        if GENERATION_CACHE_ENABLED and is_cacheable(results['explanation'], results['futureSteps']):
+            generation_cache.set(prompt, language, OPENROUTER_MODEL,
+                                 (generated_code, results['explanation'], results['futureSteps']))
+
+        yield sse_event('done', {
             'code': generated_code,
-            'explanation': explanation,
-            'futureSteps': future_steps,
+            'explanation': results['explanation'],
+            'futureSteps': results['futureSteps'],
             'message': 'Code generated successfully'
         })
-    except Exception as e:
-        logger.error(f"Error generating code: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = generation_cache.get_stats()
+    stats['in_flight'] = generation_flights.in_flight()
+    stats.update(generation_flights.stats)
+    return jsonify(stats)
+
+@app.route('/api/maintenance/stats', methods=['GET'])
+def maintenance_stats():
+    return jsonify(maintenance.stats)
+
+# Inputs larger than this are rejected before they reach an analysis worker
+ANALYSIS_MAX_CHARS = int(os.getenv('ANALYSIS_MAX_CHARS', '200000'))
 
 @app.route('/analyze', methods=['POST'])
 def analyze_code():
     try:
         data = request.get_json()
         code = data.get('code', '')
+        language = data.get('language', 'python')
         
-        # Perform code analysis (placeholder)
-        analysis = {
-            'bugs': ['No syntax errors found'],
-            'quality': ['Code follows standard conventions'],
-            'performance': ['No obvious performance issues'],
-            'security': ['No security vulnerabilities detected'],
-            'parameters': [
-                {'name': 'input', 'description': 'Sample parameter', 'type': 'string'}
-            ],
-            'examples': 'Example usage:\nprint("Hello, World!")'
-        }
+        if len(code) > ANALYSIS_MAX_CHARS:
+            return jsonify({'error': f"Code is too large to analyze (limit {ANALYSIS_MAX_CHARS} characters)"}), 413
+        
+        analysis = analysis_pool.analyze(code, language)
         
         return jsonify(analysis)
+    except AnalysisLimitExceeded as e:
+        logger.warning(f"Code analysis stopped: {str(e)}")
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error analyzing code: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+HISTORY_ITEM_MAX_AGE = int(os.getenv('HISTORY_ITEM_MAX_AGE', '3600'))
+PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', '50'))
+PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', '200'))
+
+def page_params():
+    # cursor/limit/language query parameters shared by the list endpoints
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE_DEFAULT))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+    cursor = request.args.get('cursor') or None
+    language = request.args.get('language') or None
+    # Full rows (with code, explanation and future steps) only when explicitly asked for
+    summary = request.args.get('fields', 'summary') != 'full'
+    return cursor, limit, language, summary
+
 @app.route('/api/snippets', methods=['GET', 'POST'])
 def handle_snippets():
     try:
@@ -271,36 +910,112 @@ def handle_snippets():
             snippet_id = save_snippet(title, description, code, language)
             return jsonify({'message': 'Snippet saved successfully', 'snippetId': snippet_id})
         else:
-            snippets = get_snippets()
-            return jsonify({'snippets': snippets})
+            cursor, limit, language, summary = page_params()
+            snippets, next_cursor = get_snippets_page(cursor, limit, language, summary)
+            return jsonify({'snippets': snippets, 'nextCursor': next_cursor})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     except Exception as e:
         logger.error(f"Error handling snippets: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/snippets/<int:snippet_id>', methods=['GET'])
+def get_snippet_item(snippet_id):
+    try:
+        snippet = get_snippet(snippet_id)
+        if not snippet:
+            return jsonify({'error': 'Snippet not found'}), 404
+        return jsonify(snippet)
+    except Exception as e:
+        logger.error(f"Error getting snippet: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/history', methods=['GET'])
 def get_history():
     try:
-        history = get_generation_history()
-        return jsonify({'history': history})
+        cursor, limit, language, summary = page_params()
+        history, next_cursor = get_generation_history_page(cursor, limit, language, summary)
+        return jsonify({'history': history, 'nextCursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting history: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/history/<history_id>', methods=['GET'])
+@app.route('/history/<int:history_id>', methods=['GET'])
 def get_history_item(history_id):
     try:
-        history = get_generation_history()
-        item = next((h for h in history if h['id'] == history_id), None)
-        
-        if not item:
-            return jsonify({'error': 'History item not found'}), 404
+        # History rows are never modified, so the id alone identifies a representation
+        etag = f'history-{history_id}'
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            item = get_generation_history_item(history_id)
+            
+            if not item:
+                return jsonify({'error': 'History item not found'}), 404
             
-        return jsonify(item)
+            # HTTP dates have whole seconds, so compare without the microseconds
+            last_modified = datetime.fromisoformat(item['created_at']).astimezone(timezone.utc).replace(microsecond=0)
+            if (not request.if_none_match and request.if_modified_since
+                    and last_modified <= request.if_modified_since):
+                response = Response(status=304)
+            else:
+                response = jsonify(item)
+            response.last_modified = last_modified
+        
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = HISTORY_ITEM_MAX_AGE
+        return response
     except Exception as e:
         logger.error(f"Error getting history item: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/search', methods=['GET'])
+def search():
+    try:
+        query = request.args.get('q', '').strip()
+        kind = request.args.get('type', 'all')
+        language = request.args.get('language') or None
+        try:
+            limit = max(1, min(int(request.args.get('limit', 20)), PAGE_SIZE_MAX))
+            offset = max(0, int(request.args.get('offset', 0)))
+        except ValueError:
+            return jsonify({'error': 'limit and offset must be integers'}), 400
+        
+        if not query:
+            return jsonify({'error': 'Query parameter q is required'}), 400
+        if kind not in ('all', 'snippets', 'history'):
+            return jsonify({'error': f"Unknown search type: {kind}"}), 400
+        
+        # Ask for one extra row to know whether another page exists
+        results = search_code(query, kind, language, limit + 1, offset)
+        next_offset = offset + limit if len(results) > limit else None
+        return jsonify({'results': results[:limit], 'nextOffset': next_offset})
+    except Exception as e:
+        logger.error(f"Error searching: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Share ids are a fixed-width millisecond timestamp followed by random characters, both in
+# shortuuid's unambiguous alphabet: short in URLs, sorted by creation time so new rows land at
+# the end of the primary key index, and far too random to collide within a millisecond
+SHARE_ID_ALPHABET = shortuuid.get_alphabet()
+SHARE_ID_TIME_LENGTH = 8  # 57**8 milliseconds lasts until well past the year 5000
+SHARE_ID_RANDOM_LENGTH = int(os.getenv('SHARE_ID_RANDOM_LENGTH', '8'))
+SHARE_ID_ATTEMPTS = 5
+share_id_random = shortuuid.ShortUUID()
+
+def new_share_id():
+    timestamp = time.time_ns() // 1_000_000
+    prefix = ''
+    for _ in range(SHARE_ID_TIME_LENGTH):
+        timestamp, digit = divmod(timestamp, len(SHARE_ID_ALPHABET))
+        prefix = SHARE_ID_ALPHABET[digit] + prefix
+    return prefix + share_id_random.random(length=SHARE_ID_RANDOM_LENGTH)
+
 @app.route('/share', methods=['POST'])
 def share_code():
     try:
@@ -311,10 +1026,17 @@ def share_code():
         if not code:
             return jsonify({'error': 'Code is required'}), 400
 
-        share_id = f"share_{datetime.now().strftime('%Y%m%d%H%M%S')}"
         expires = (datetime.now() + timedelta(days=7)).isoformat()
-        
-        save_shared_code(share_id, code, language, expires)
+
+        # Sharing the same code again returns the existing share
+        for attempt in range(SHARE_ID_ATTEMPTS):
+            try:
+                share_id = save_shared_code(new_share_id(), code, language, expires)
+                break
+            except sqlite3.IntegrityError:
+                if attempt == SHARE_ID_ATTEMPTS - 1:
+                    raise
+                logger.warning("Share id collision, retrying with a new id")
 
         return jsonify({
             'message': 'Code shared successfully',
@@ -325,34 +1047,67 @@ def share_code():
         logger.error(f"Error sharing code: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Shared pages are highlighted server-side; renders are cached by content so repeat views skip pygments
+SHARE_THEME = os.getenv('SHARE_THEME', 'monokai')
+shared_renders = HighlightCache(
+    max_entries=int(os.getenv('SHARE_RENDER_CACHE_SIZE', '256')),
+    persistent=os.getenv('SHARE_RENDER_CACHE_PERSISTENT', '1') == '1'
+)
+
 @app.route('/shared/<share_id>')
 def view_shared_code(share_id):
     try:
+        theme = request.args.get('theme', SHARE_THEME)
+        if theme not in themes():
+            return render_template('error.html', message=f"Unknown theme: {theme}"), 400
+        
         shared_code = get_shared_code(share_id)
         
         if not shared_code:
             return render_template('error.html', message='Shared code not found or has expired'), 404
         
-        if datetime.fromisoformat(shared_code['expires']) < datetime.now():
+        expires_at = datetime.fromisoformat(shared_code['expires_at'])
+        remaining = (expires_at - datetime.now()).total_seconds()
+        if remaining <= 0:
             return render_template('error.html', message='Shared code has expired'), 410
         
-        return render_template('shared.html', code=shared_code)
+        # A share never changes before it expires, so everything on the page is fixed by these values
+        code_hash = shared_code['code_hash']
+        etag = content_hash('\x1f'.join([
+            share_id, code_hash, shared_code['language'], theme, shared_code['created_at'], shared_code['expires_at']
+        ]))
+        
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            highlighted = shared_renders.render(shared_code['code'], shared_code['language'], theme, code_hash)
+            response = Response(render_template(
+                'shared.html', code=shared_code, highlighted=highlighted, highlight_css=highlight_css(theme)))
+        
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = int(remaining)
+        response.expires = expires_at.astimezone(timezone.utc)
+        return response
     except Exception as e:
         logger.error(f"Error viewing shared code: {str(e)}")
         return render_template('error.html', message='Error viewing shared code'), 500
 
 @app.route('/collaborate/<room_id>', methods=['POST'])
-def collaborate(room_id):
-    data = request.json
-    pusher_client.trigger(f'room-{room_id}', 'code-update', {
-        'code': data.get('code'),
-        'language': data.get('language'),
-        'cursor': data.get('cursor')
-    })
-    return jsonify({'status': 'success'})
+def publish_room_update(room_id):
+    # Batched into a 'room-update' event: {'code', 'language', 'sender', 'participants': {clientId: {'cursor'}}}
+    data = request.json or {}
+    client_id = data.get('clientId') or request.remote_addr
+    if data.get('code') is not None:
+        pusher_updates.update(room_id, code=data['code'], language=data.get('language'), sender=client_id)
+    elif data.get('language'):
+        pusher_updates.update(room_id, language=data['language'], sender=client_id)
+    if data.get('cursor') is not None:
+        pusher_updates.update(room_id, client_id, cursor=data['cursor'])
+    return jsonify({'status': 'queued'}), 202
 
 @app.route('/collaborate/join/<room_id>')
-def join_room(room_id):
+def join_collaboration_room(room_id):
     return render_template('collaborate.html', room_id=room_id)
 
 @app.route('/collaborate', methods=['GET', 'POST'])
@@ -378,7 +1133,7 @@ def pusher_config():
         'cluster': os.getenv('PUSHER_CLUSTER')
     })
 
-@socketio.on('join_session')
+@socket_event('join_session')
 def handle_join_session(data):
     session_id = data.get('session_id')
     username = data.get('username', f"User_{str(uuid.uuid4())[:8]}")
@@ -391,30 +1146,29 @@ def handle_join_session(data):
     session['username'] = username
     
     collab_session = get_collaboration_session(session_id)
-    if collab_session:
-        code = collab_session.get('code', '')
-        language = collab_session.get('language', 'python')
-    else:
-        code = ''
-        language = 'python'
+    if not collab_session:
         create_collaboration_session(session_id, username)
+        collab_session = get_collaboration_session(session_id)
     
-    if session_id not in active_sessions:
-        active_sessions[session_id] = {'participants': set()}
-    active_sessions[session_id]['participants'].add(username)
+    document = collab_documents.get_or_create(
+        session_id, lambda: load_collaboration_state(session_id, collab_session))
+    snapshot = document.snapshot()
+    
+    participants = presence.join(request.sid, session_id, username)
     
     emit('participant_joined', {
         'participant': username,
-        'participants': list(active_sessions[session_id]['participants'])
+        'participants': participants
     }, room=session_id)
     
     emit('session_joined', {
-        'code': code,
-        'language': language,
-        'participants': list(active_sessions[session_id]['participants'])
+        'code': snapshot['code'],
+        'language': snapshot['language'],
+        'revision': snapshot['revision'],
+        'participants': participants
     })
 
-@socketio.on('leave_session')
+@socket_event('leave_session')
 def handle_leave_session(data):
     session_id = session.get('session_id')
     username = session.get('username')
@@ -423,21 +1177,70 @@ def handle_leave_session(data):
         return
     
     leave_room(session_id)
+    leave_collaboration()
+
+@socket_event('disconnect')
+def handle_disconnect(reason=None):
+    # python-socketio >= 5.12 passes the reason; without the argument the call fails and is retried.
+    # A dropped connection (a page refresh, a network blip) doesn't end the session, leave_session does.
+    leave_collaboration(end_when_empty=False)
+
+def leave_collaboration(end_when_empty=True):
+    membership = presence.leave(request.sid)
+    if membership is None:
+        return
+    session_id, username, participants = membership
+    collab_writes.flush(session_id)
     
-    if session_id in active_sessions:
-        active_sessions[session_id]['participants'].discard(username)
+    emit('participant_left', {
+        'participant': username,
+        'participants': participants
+    }, room=session_id)
+    
+    # Presence is shared across workers, so this is the last participant anywhere
+    if not participants:
+        collab_documents.drop(session_id)
+        if end_when_empty:
+            end_collaboration_session(session_id)
+
+def get_room_document(session_id):
+    return collab_documents.get_or_create(
+        session_id, lambda: load_collaboration_state(session_id, get_collaboration_session(session_id)))
+
+@socket_event('code_ops')
+def handle_code_ops(data):
+    # Delta protocol: {'revision': <revision the ops were made against>, 'ops': [...], 'language'?: str}
+    session_id = session.get('session_id')
+    if not session_id:
+        return
+    
+    document = get_room_document(session_id)
+    # Hold the document lock through the broadcast so this worker emits ops in revision order.
+    # Ops committed on different workers can still arrive out of order; clients apply them by revision.
+    with document.lock:
+        try:
+            revision, ops = document.apply(data.get('revision'), data.get('ops'), data.get('language'))
+        except StaleRevision:
+            emit('resync', document.snapshot())
+            return
+        except InvalidOperation as e:
+            emit('ops_rejected', {'error': str(e), 'revision': data.get('revision')})
+            emit('resync', document.snapshot())
+            return
         
-        emit('participant_left', {
-            'participant': username,
-            'participants': list(active_sessions[session_id]['participants'])
-        }, room=session_id)
+        collab_writes.update(session_id, document.text, document.language)
         
-        if not active_sessions[session_id]['participants']:
-            del active_sessions[session_id]
-            end_collaboration_session(session_id)
+        emit('code_ops', {
+            'revision': revision,
+            'ops': ops,
+            'language': document.language,
+            'sender': session.get('username')
+        }, room=session_id, include_self=False)
+        emit('ops_ack', {'revision': revision})
 
-@socketio.on('code_change')
+@socket_event('code_change')
 def handle_code_change(data):
+    # Full-document updates from clients that don't send ops; op clients treat code_updated as a resync
     session_id = session.get('session_id')
     if not session_id:
         return
@@ -445,14 +1248,18 @@ def handle_code_change(data):
     code = data.get('code', '')
     language = data.get('language', 'python')
     
-    update_collaboration_code(session_id, code, language)
-    
-    emit('code_updated', {
-        'code': code,
-        'language': language
-    }, room=session_id, include_self=False)
+    document = get_room_document(session_id)
+    with document.lock:
+        revision, _ = document.replace(code, language)
+        collab_writes.update(session_id, code, language)
+        
+        emit('code_updated', {
+            'code': code,
+            'language': language,
+            'revision': revision
+        }, room=session_id, include_self=False)
 
-@socketio.on('chat_message')
+@socket_event('chat_message')
 def handle_chat_message(data):
     session_id = session.get('session_id')
     username = session.get('username')
@@ -473,7 +1280,7 @@ def handle_chat_message(data):
         'timestamp': datetime.now().isoformat()
     }, room=session_id)
 
-@socketio.on('typing')
+@socket_event('typing')
 def handle_typing(data):
     session_id = session.get('session_id')
     username = session.get('username')
@@ -481,14 +1288,32 @@ def handle_typing(data):
     if not session_id or not username:
         return
         
-    is_typing = data.get('typing', False)
+    # Delivered in the next 'room_activity' batch: {'participants': {username: {'typing', 'cursor'}}}
+    room_events.update(session_id, username, typing=bool(data.get('typing', False)))
+
+@socket_event('cursor')
+def handle_cursor(data):
+    session_id = session.get('session_id')
+    username = session.get('username')
     
-    emit('user_typing', {
-        'participant': username,
-        'typing': is_typing
-    }, room=session_id, include_self=False)
+    if not session_id or not username:
+        return
+    
+    room_events.update(session_id, username, cursor=data.get('cursor'))
+
+@socket_event('watch_job')
+def handle_watch_job(data):
+    job_id = data.get('jobId')
+    if not job_id:
+        return
+    
+    join_room(f"job-{job_id}")
+    # The job may have finished before the client subscribed
+    job = generation_jobs.get(job_id)
+    if job and job['status'] in ('completed', 'failed'):
+        emit('generation_complete', public_job(job))
 
-@socketio.on('end_session')
+@socket_event('end_session')
 def handle_end_session(data):
     session_id = session.get('session_id')
     username = session.get('username')
@@ -496,16 +1321,97 @@ def handle_end_session(data):
     if not session_id or not username:
         return
         
+    collab_writes.flush(session_id)
+    collab_documents.drop(session_id)
     end_collaboration_session(session_id)
-    
-    if session_id in active_sessions:
-        del active_sessions[session_id]
+    presence.clear(session_id)
     
     emit('session_ended', {
         'message': f'Session ended by {username}'
     }, room=session_id)
 
+# Importing the app starts no threads, processes or database work, so a serverless platform or a
+# tool that only imports it pays for none of that. server.py and `python app.py` call startup()
+# before serving; under any other WSGI server the first request or Socket.IO event runs it.
+startup_lock = threading.Lock()
+started = False
+
+def startup():
+    global started
+    with startup_lock:
+        if started:
+            return
+        startup_started = time.perf_counter()
+        # Forked before the log listener or any other thread exists
+        analysis_pool.start()
+
+        # Configure logging: LOG_LEVEL gates verbosity and LOG_FORMAT is 'text' or 'json'. Records are
+        # written by a background listener, and request/response payloads are truncated to LOG_PAYLOAD_LIMIT
+        # characters and sampled at LOG_PAYLOAD_SAMPLE_RATE.
+        logs.setup(
+            level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+            fmt=os.getenv('LOG_FORMAT', 'text'),
+            queue_size=int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+            payload_limit=int(os.getenv('LOG_PAYLOAD_LIMIT', '2000')),
+            sample_rate=float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '1'))
+        )
+
+        # Schema migrations run once per database; on an up-to-date database this is a single query
+        migration_started = time.perf_counter()
+        applied_migrations = init_db()
+        startup_timings['database'] = time.perf_counter() - migration_started
+        if applied_migrations:
+            logger.info(f"Applied schema migrations: {', '.join(applied_migrations)}")
+
+        if MAINTENANCE_ENABLED:
+            maintenance.start()
+        if GENERATION_QUEUE_URL:
+            generation_jobs.start()
+
+        startup_timings['startup'] = time.perf_counter() - startup_started
+        startup_timings['total'] = startup_timings['imports'] + startup_timings['setup'] + startup_timings['startup']
+        logger.info(
+            f"Started in {startup_timings['total'] * 1000:.1f}ms (imports {startup_timings['imports'] * 1000:.1f}ms, "
+            f"setup {startup_timings['setup'] * 1000:.1f}ms, startup {startup_timings['startup'] * 1000:.1f}ms "
+            f"of which database {startup_timings['database'] * 1000:.1f}ms)"
+        )
+        started = True
+
+@app.before_request
+def ensure_started():
+    if not started:
+        startup()
+
+shutting_down = False
+
+def shutdown(timeout=0):
+    # Ordered teardown, run once: by server.py on SIGTERM, with `timeout` seconds for generation
+    # jobs to finish, and at interpreter exit. Jobs go first since they save history and emit
+    # results; buffered edits and batched events are flushed before the connection pool closes.
+    global shutting_down
+    if shutting_down:
+        return
+    shutting_down = True
+    generation_jobs.shutdown(timeout)
+    room_events.stop()
+    pusher_updates.stop()
+    collab_writes.stop()
+    presence.stop()
+    maintenance.stop()
+    analysis_pool.shutdown()
+    followup_executor.shutdown(wait=False)
+    stream_executor.shutdown(wait=False)
+    close_pool()
+
+atexit.register(shutdown)
+
+startup_timings['setup'] = time.perf_counter() - STARTUP_STARTED - startup_timings['imports']
+metrics.callback('app_startup_seconds', 'Time spent starting this process, by phase',
+                 lambda: {(phase,): seconds for phase, seconds in startup_timings.items()}, ['phase'])
+
 if __name__ == '__main__':
+    # Development server with the reloader and debugger; production runs through server.py
+    startup()
     port = 5008  # Starting port
     max_retries = 10
     
@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from load_test import git_commit, summarize
+
+# Cold start of the app: spawns fresh interpreters that import it and run app.startup(), as server.py
+# does, and reports wall time, the app's own startup_timings phases and, from -X importtime, the
+# modules that cost the most.
+# Runs alternate between a fresh database (every migration applies) and an up-to-date one.
+#
+#   python benchmarks/cold_start.py --runs 10 --output cold_start.json
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE = 'import json, app; app.startup(); print(json.dumps(app.startup_timings)); app.shutdown()'
+
+def parse_importtime(stderr):
+    # Lines look like "import time:   1234 |   5678 |   package.module"
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        modules[name] = modules.get(name, 0) + int(parts[0])
+    return modules
+
+def run_once(database, env):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE], cwd=APP_DIR, capture_output=True, text=True,
+        env=dict(env, DATABASE_PATH=database)
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"app startup failed: {result.stderr.strip().splitlines()[-1:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return elapsed, timings, parse_importtime(result.stderr)
+
+def phase_summary(runs):
+    phases = {}
+    for _, timings, _ in runs:
+        for phase, seconds in timings.items():
+            phases.setdefault(phase, []).append(seconds)
+    return {phase: summarize(samples) for phase, samples in phases.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start of the app module')
+    parser.add_argument('--runs', type=int, default=5, help='interpreters per database state')
+    parser.add_argument('--top', type=int, default=15, help='slowest modules to list, by self time')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    # Keep the run hermetic: no external services, no background sweeps
+    env = {key: value for key, value in os.environ.items() if key not in ('REDIS_URL', 'MAINTENANCE_ENABLED')}
+    scratch = tempfile.mkdtemp(prefix='cold-start-')
+    runs = {'fresh_db': [], 'existing_db': []}
+    try:
+        existing = os.path.join(scratch, 'existing.db')
+        run_once(existing, env)
+        for index in range(args.runs):
+            runs['fresh_db'].append(run_once(os.path.join(scratch, f"fresh-{index}.db"), env))
+            runs['existing_db'].append(run_once(existing, env))
+            print(f"run {index + 1}/{args.runs} done", file=sys.stderr, flush=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    modules = {}
+    all_runs = runs['fresh_db'] + runs['existing_db']
+    for _, _, imported in all_runs:
+        for name, micros in imported.items():
+            modules[name] = modules.get(name, 0) + micros
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    report = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'wall': {state: summarize([elapsed for elapsed, _, _ in samples]) for state, samples in runs.items()},
+        'phases': {state: phase_summary(samples) for state, samples in runs.items()},
+        'slowest_imports_ms': {name: round(micros / len(all_runs) / 1000, 2) for name, micros in slowest}
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenRouter chat completions endpoint. Point the app at it with
+#   OPENROUTER_API_URL=http://127.0.0.1:8090/api/v1/chat/completions
+# Responses follow the shape app.py parses: choices[0].message.content for plain calls,
+# SSE chunks with choices[0].delta.content for stream: true, and a usage block on both.
+
+STRUCTURED_MARKERS = ('===CODE===', '===EXPLANATION===', '===FUTURE_STEPS===')
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+def completion_text(messages, size):
+    prompt = '\n'.join(str(message.get('content', '')) for message in messages)
+    filler = ' '.join(['lorem'] * size)
+    code = f"def solve(values):\n    # {filler}\n    return sorted(values)\n"
+    if STRUCTURED_MARKERS[0] in prompt:
+        return (
+            f"{STRUCTURED_MARKERS[0]}\n{code}\n"
+            f"{STRUCTURED_MARKERS[1]}\nSorts the input. {filler}\n"
+            f"{STRUCTURED_MARKERS[2]}\n1. Add tests. {filler}\n"
+        )
+    # Match the follow-up prompts built in app.py
+    if 'Explain in detail how' in prompt:
+        return f"This code sorts the input values. {filler}"
+    if 'next steps to improve' in prompt:
+        return f"1. Add tests\n2. Handle empty input\n{filler}"
+    return f"```python\n{code}```"
+
+class FakeOpenRouter:
+    def __init__(self, latency=0.2, jitter=0.05, error_rate=0.0, error_status=500,
+                 rate_limit_rate=0.0, retry_after=1, chunks=20, chunk_delay=0.01, size=50, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.size = size
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'streamed': 0, 'errors': 0, 'rate_limited': 0}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def draw(self):
+        with self._lock:
+            return self.random.random(), self.random.uniform(-self.jitter, self.jitter)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            return self.send_json(200, self.fake.stats)
+        self.send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        fake = self.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self.send_json(400, {'error': {'message': 'Invalid JSON'}})
+        fake.count('requests')
+
+        roll, jitter = fake.draw()
+        time.sleep(max(0.0, fake.latency + jitter))
+        if roll < fake.rate_limit_rate:
+            fake.count('rate_limited')
+            return self.send_json(429, {'error': {'message': 'Rate limited'}},
+                                  {'Retry-After': str(fake.retry_after)})
+        if roll < fake.rate_limit_rate + fake.error_rate:
+            fake.count('errors')
+            return self.send_json(fake.error_status, {'error': {'message': 'Injected upstream error'}})
+
+        messages = data.get('messages') or []
+        content = completion_text(messages, fake.size)
+        prompt_tokens = sum(estimate_tokens(str(message.get('content', ''))) for message in messages)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': estimate_tokens(content),
+            'total_tokens': prompt_tokens + estimate_tokens(content)
+        }
+        completion_id = f"gen-{uuid.uuid4().hex}"
+        model = data.get('model', 'fake/model')
+        if data.get('stream'):
+            fake.count('streamed')
+            return self.stream(completion_id, model, content, usage)
+        self.send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': usage
+        })
+
+    def stream(self, completion_id, model, content, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def send(line):
+            self.wfile.write(f"{line}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        send(': OPENROUTER PROCESSING')
+        step = max(1, -(-len(content) // self.fake.chunks))
+        for start in range(0, len(content), step):
+            send('data: ' + json.dumps({
+                'id': completion_id,
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': content[start:start + step]}}]
+            }))
+            time.sleep(self.fake.chunk_delay)
+        send('data: ' + json.dumps({
+            'id': completion_id,
+            'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+            'usage': usage
+        }))
+        send('data: [DONE]')
+
+def serve(fake, host='127.0.0.1', port=8090):
+    handler = type('FakeOpenRouterHandler', (Handler,), {'fake': fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Local OpenRouter stand-in for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds before each response starts')
+    parser.add_argument('--jitter', type=float, default=0.05, help='+/- seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with --error-status')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--chunks', type=int, default=20, help='SSE chunks per streamed completion')
+    parser.add_argument('--chunk-delay', type=float, default=0.01, help='seconds between SSE chunks')
+    parser.add_argument('--size', type=int, default=50, help='filler words per completion')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    fake = FakeOpenRouter(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, chunks=args.chunks,
+        chunk_delay=args.chunk_delay, size=args.size, seed=args.seed
+    )
+    server = serve(fake, args.host, args.port)
+    print(f"Fake OpenRouter listening on http://{args.host}:{args.port}/api/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
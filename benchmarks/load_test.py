@@ -0,0 +1,393 @@
+import argparse
+import json
+import math
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+# Load scenarios against a running app. Every scenario reports latency percentiles, throughput and
+# how many rows it inserted, updated or deleted per second, read from the app's
+# db_rows_changed_total metric. With --database it also gives the row-count change per table. The
+# report is JSON so runs can be diffed or compared with --baseline.
+#
+#   python benchmarks/fake_openrouter.py --latency 0.3 &
+#   OPENROUTER_API_URL=http://127.0.0.1:8090/api/v1/chat/completions python app.py &
+#   python benchmarks/load_test.py --base-url http://127.0.0.1:5008 --database code_generator.db \
+#       --output results.json
+
+SCENARIOS = ('generate', 'history', 'snippets', 'share', 'socketio')
+WRITE_TABLES = (
+    'generation_history', 'snippets', 'shared_code', 'code_blobs',
+    'collaboration_sessions', 'collaboration_messages'
+)
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2)
+    }
+
+class Recorder:
+    # Latency samples and outcome counts for one operation, safe to share between worker threads
+    def __init__(self):
+        self.samples = []
+        self.statuses = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, status, ok=True):
+        with self._lock:
+            if ok:
+                self.samples.append(seconds)
+            else:
+                self.errors += 1
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+
+    def report(self, elapsed):
+        result = summarize(self.samples)
+        result['errors'] = self.errors
+        result['statuses'] = self.statuses
+        result['throughput_per_s'] = round(len(self.samples) / elapsed, 2) if elapsed else None
+        return result
+
+def count_rows(database):
+    if not database:
+        return None
+    conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True, timeout=30)
+    try:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in WRITE_TABLES}
+    finally:
+        conn.close()
+
+def rows_changed(base_url):
+    # Scraped from /metrics, so it covers UPDATEs and DELETEs that leave row counts unchanged
+    try:
+        response = requests.get(f"{base_url}/metrics", timeout=10)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+    for line in response.text.splitlines():
+        if line.startswith('db_rows_changed_total '):
+            return float(line.split()[1])
+    # Not exported until the first change
+    return 0.0
+
+def timed(recorder, session, method, url, ok_statuses=(200,), **kwargs):
+    started = time.perf_counter()
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.RequestException as e:
+        recorder.record(time.perf_counter() - started, type(e).__name__, ok=False)
+        return None
+    recorder.record(time.perf_counter() - started, response.status_code, response.status_code in ok_statuses)
+    return response
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.base_url.rstrip('/')
+        self._local = threading.local()
+
+    def session(self):
+        # One cookie jar per worker thread, so each worker looks like a separate browser
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def run_workers(self, operation, count):
+        # Runs operation(index) `count` times over --concurrency threads; returns wall time in seconds
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            for future in [executor.submit(operation, index) for index in range(count)]:
+                future.result()
+        return time.perf_counter() - started
+
+    def prompt(self, index):
+        # --prompt-pool N cycles through N prompts so repeats hit the generation cache
+        key = index % self.args.prompt_pool if self.args.prompt_pool else f"{index}-{uuid.uuid4().hex[:8]}"
+        return f"Write a function that sorts a list of numbers (benchmark {key})"
+
+    def scenario_generate(self):
+        submitted, completed = Recorder(), Recorder()
+        throttled = [0]
+        lock = threading.Lock()
+
+        def operation(index):
+            session = self.session()
+            started = time.perf_counter()
+            while True:
+                response = timed(submitted, session, 'POST', f"{self.base_url}/generate", ok_statuses=(202, 429),
+                                 json={'prompt': self.prompt(index), 'language': 'python'})
+                if response is None or response.status_code != 429:
+                    break
+                with lock:
+                    throttled[0] += 1
+                time.sleep(float(response.headers.get('Retry-After', '1')))
+            if response is None or response.status_code != 202:
+                completed.record(time.perf_counter() - started, 'submit_failed', ok=False)
+                return
+            status_url = f"{self.base_url}{response.json()['statusUrl']}"
+            deadline = time.monotonic() + self.args.job_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.args.poll_interval)
+                try:
+                    job = session.get(status_url).json()
+                except (requests.RequestException, ValueError):
+                    continue
+                if job.get('status') in ('completed', 'failed'):
+                    completed.record(time.perf_counter() - started, job['status'], job['status'] == 'completed')
+                    return
+            completed.record(time.perf_counter() - started, 'timeout', ok=False)
+
+        elapsed = self.run_workers(operation, self.args.requests)
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'submit': submitted.report(elapsed),
+            'end_to_end': completed.report(elapsed),
+            'throttled': throttled[0]
+        }
+
+    def scenario_history(self):
+        recorder = Recorder()
+        elapsed = self.run_workers(
+            lambda index: timed(recorder, self.session(), 'GET', f"{self.base_url}/history",
+                                params={'limit': self.args.page_size}),
+            self.args.requests
+        )
+        return {'elapsed_s': round(elapsed, 3), 'list': recorder.report(elapsed)}
+
+    def scenario_snippets(self):
+        reads, writes = Recorder(), Recorder()
+        every = max(1, round(1 / self.args.write_ratio)) if self.args.write_ratio > 0 else None
+
+        def operation(index):
+            session = self.session()
+            if every and index % every == 0:
+                timed(writes, session, 'POST', f"{self.base_url}/api/snippets", json={
+                    'title': f"Benchmark snippet {index}",
+                    'description': 'Written by benchmarks/load_test.py',
+                    'code': f"def snippet_{index}():\n    return {index}\n",
+                    'language': 'python'
+                })
+            else:
+                timed(reads, session, 'GET', f"{self.base_url}/api/snippets", params={'limit': self.args.page_size})
+
+        elapsed = self.run_workers(operation, self.args.requests)
+        return {'elapsed_s': round(elapsed, 3), 'list': reads.report(elapsed), 'create': writes.report(elapsed)}
+
+    def scenario_share(self):
+        shares, views, revalidations = Recorder(), Recorder(), Recorder()
+
+        def operation(index):
+            session = self.session()
+            response = timed(shares, session, 'POST', f"{self.base_url}/share", json={
+                'code': f"def shared_{index}_{uuid.uuid4().hex[:8]}(values):\n    return sorted(values)\n" * 20,
+                'language': 'python'
+            })
+            if response is None or response.status_code != 200:
+                return
+            url = f"{self.base_url}/shared/{response.json()['shareId']}"
+            view = timed(views, session, 'GET', url)
+            if view is not None and view.headers.get('ETag'):
+                timed(revalidations, session, 'GET', url, ok_statuses=(304,),
+                      headers={'If-None-Match': view.headers['ETag']})
+
+        elapsed = self.run_workers(operation, self.args.requests)
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'share': shares.report(elapsed),
+            'view': views.report(elapsed),
+            'revalidate': revalidations.report(elapsed)
+        }
+
+    def scenario_socketio(self):
+        import socketio
+
+        chat, code = Recorder(), Recorder()
+        sent = {}
+        sent_lock = threading.Lock()
+        clients = []
+
+        def on_chat(data):
+            with sent_lock:
+                started = sent.pop(('chat', data.get('message')), None)
+            if started is not None:
+                chat.record(time.perf_counter() - started, 'delivered')
+
+        def on_code(data):
+            # Every other participant receives code_updated; time the first delivery of each change
+            marker = (data.get('code') or '').split('\n', 1)[0]
+            with sent_lock:
+                started = sent.pop(('code', marker), None)
+            if started is not None:
+                code.record(time.perf_counter() - started, 'delivered')
+
+        for room in range(self.args.rooms):
+            room_id = f"bench-{uuid.uuid4().hex[:12]}"
+            for member in range(self.args.clients_per_room):
+                client = socketio.Client(reconnection=False)
+                client.on('chat_message', on_chat)
+                client.on('code_updated', on_code)
+                joined = threading.Event()
+                client.on('session_joined', lambda data, joined=joined: joined.set())
+                client.connect(self.base_url, wait_timeout=10)
+                client.emit('join_session', {'session_id': room_id, 'username': f"bench-{room}-{member}"})
+                joined.wait(10)
+                clients.append(client)
+
+        def operation(index):
+            client = clients[index % len(clients)]
+            if index % 2:
+                message = f"chat {index} {uuid.uuid4().hex[:8]}"
+                with sent_lock:
+                    sent[('chat', message)] = time.perf_counter()
+                client.emit('chat_message', {'message': message})
+            else:
+                marker = f"# change {index} {uuid.uuid4().hex[:8]}"
+                with sent_lock:
+                    sent[('code', marker)] = time.perf_counter()
+                client.emit('code_change', {'code': f"{marker}\nprint({index})\n", 'language': 'python'})
+            time.sleep(self.args.message_interval)
+
+        elapsed = self.run_workers(operation, self.args.requests)
+        # Give in-flight broadcasts a moment to arrive before counting them as lost
+        deadline = time.monotonic() + 5
+        while sent and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with sent_lock:
+            lost = {'chat': 0, 'code': 0}
+            for kind, _ in sent:
+                lost[kind] += 1
+        for client in clients:
+            client.disconnect()
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'clients': len(clients),
+            'chat_message': dict(chat.report(elapsed), lost=lost['chat']),
+            'code_change': dict(code.report(elapsed), lost=lost['code'])
+        }
+
+    def run(self, scenarios):
+        report = {
+            'started_at': datetime.now().isoformat(),
+            'base_url': self.base_url,
+            'commit': git_commit(),
+            'config': vars(self.args),
+            'scenarios': {}
+        }
+        for name in scenarios:
+            before, changed_before = count_rows(self.args.database), rows_changed(self.base_url)
+            result = getattr(self, f"scenario_{name}")()
+            if name == 'socketio':
+                # Collaboration edits are written behind; let the last flush land
+                time.sleep(self.args.settle)
+            after, changed_after = count_rows(self.args.database), rows_changed(self.base_url)
+            db = {}
+            if changed_before is not None and changed_after is not None:
+                db['rows_changed'] = int(changed_after - changed_before)
+                db['rows_per_s'] = round(db['rows_changed'] / result['elapsed_s'], 2)
+            if before is not None:
+                db['row_count_delta'] = {
+                    table: after[table] - before[table] for table in WRITE_TABLES if after[table] != before[table]
+                }
+            if db:
+                result['db'] = db
+            report['scenarios'][name] = result
+            print(f"{name}: done in {result['elapsed_s']}s", file=sys.stderr, flush=True)
+        if self.args.fake_openrouter:
+            try:
+                report['upstream'] = requests.get(f"{self.args.fake_openrouter.rstrip('/')}/stats", timeout=5).json()
+            except requests.RequestException:
+                report['upstream'] = None
+        return report
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(report, baseline):
+    # Relative change against a previous report for every latency percentile and throughput figure
+    changes = {}
+    for scenario, result in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        for operation, metrics in result.items():
+            if not isinstance(metrics, dict) or not isinstance(previous.get(operation), dict):
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_per_s', 'rows_per_s'):
+                old, new = previous[operation].get(metric), metrics.get(metric)
+                if old and new is not None:
+                    changes[f"{scenario}.{operation}.{metric}"] = {
+                        'before': old, 'after': new, 'change_pct': round((new - old) / old * 100, 1)
+                    }
+    return {'commit': baseline.get('commit'), 'started_at': baseline.get('started_at'), 'changes': changes}
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the code generation app')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5008')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=200, help='operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--database', help='SQLite file the app writes to, for row-count changes per table')
+    parser.add_argument('--settle', type=float, default=3, help='seconds to wait for write-behind flushes after socketio')
+    parser.add_argument('--fake-openrouter', help='fake OpenRouter base URL, to include its call counts')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--write-ratio', type=float, default=0.1, help='fraction of snippet operations that create one')
+    parser.add_argument('--prompt-pool', type=int, default=0, help='distinct prompts for /generate (0 = all unique)')
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--job-timeout', type=float, default=120)
+    parser.add_argument('--rooms', type=int, default=5)
+    parser.add_argument('--clients-per-room', type=int, default=4)
+    parser.add_argument('--message-interval', type=float, default=0.01, help='pause after each SocketIO emit')
+    parser.add_argument('--baseline', help='previous report to compare against')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    report = LoadTest(args).run(scenarios)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['baseline'] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
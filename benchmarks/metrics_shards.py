@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Checks that metric shards stay bounded under each server concurrency model and times the
+# increment hot path. Every mode runs in its own interpreter, because monkey patching can't be
+# undone: threading (python app.py) and eventlet/gevent (server.py, patched the same way).
+#
+#   python benchmarks/metrics_shards.py --tasks 2000
+#
+# Exits with status 1 if a mode leaves more shards than OS threads, or loses increments.
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('threading', 'eventlet', 'gevent')
+
+def probe(mode, tasks, increments):
+    sys.path.insert(0, APP_DIR)
+    if mode != 'threading':
+        from server import patch
+        patch(mode, 4)
+    import threading
+    import metrics
+
+    counter = metrics.Counter('probe_total', 'Probe counter', ('kind',))
+    histogram = metrics.Histogram('probe_seconds', 'Probe histogram')
+
+    def work():
+        for _ in range(increments):
+            counter.inc('work')
+            histogram.observe(0.01)
+
+    started = time.perf_counter()
+    if mode == 'eventlet':
+        # Spawned the way the WSGI servers spawn a greenlet per connection, not through threading
+        import eventlet
+        pool = eventlet.GreenPool(tasks)
+        for _ in range(tasks):
+            pool.spawn_n(work)
+        pool.waitall()
+    elif mode == 'gevent':
+        import gevent
+        gevent.joinall([gevent.spawn(work) for _ in range(tasks)])
+    else:
+        # Batches keep the threading mode from holding thousands of OS threads at once
+        for offset in range(0, tasks, 100):
+            batch = [threading.Thread(target=work) for _ in range(min(100, tasks - offset))]
+            for thread in batch:
+                thread.start()
+            for thread in batch:
+                thread.join()
+    elapsed = time.perf_counter() - started
+
+    totals = counter._collect()
+    histogram_totals = histogram._collect()
+    return {
+        'tasks': tasks,
+        'shards': len(counter._shards),
+        'histogram_shards': len(histogram._shards),
+        'counted': totals.get(('work',), 0),
+        'observed': histogram_totals.get((), [0])[-1],
+        'expected': tasks * increments,
+        'ns_per_update': round(elapsed / (tasks * increments * 2) * 1e9, 1)
+    }
+
+def run_mode(mode, args):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--probe', mode, '--tasks', str(args.tasks),
+         '--increments', str(args.increments)],
+        cwd=APP_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else f"exited with status {result.returncode}"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Check metric shard growth per concurrency model')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma-separated subset of ' + ', '.join(MODES))
+    parser.add_argument('--tasks', type=int, default=2000, help='threads or greenlets to run')
+    parser.add_argument('--increments', type=int, default=50, help='updates per task and metric')
+    parser.add_argument('--probe', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe(args.probe, args.tasks, args.increments)))
+        return
+
+    report = {mode: run_mode(mode, args) for mode in args.modes.split(',')}
+    print(json.dumps(report, indent=2))
+    # Finished threads are retired; green modes keep one shard per OS thread that ran a task
+    failed = [
+        mode for mode, result in report.items()
+        if 'error' not in result and (
+            max(result['shards'], result['histogram_shards']) > 1
+            or result['counted'] != result['expected'] or result['observed'] != result['expected'])
+    ]
+    if failed:
+        sys.exit(f"Shards not bounded or updates lost in: {', '.join(failed)}")
+
+if __name__ == '__main__':
+    main()
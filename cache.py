@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from database import get_cached_generation, save_cached_generation, count_cached_generations
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    # Thread-safe in-process LRU with an optional per-entry TTL (in seconds)
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+def normalize_prompt(prompt):
+    # "Factorial  in Python " and "factorial in python" should share an entry
+    return ' '.join((prompt or '').lower().split())
+
+def generation_cache_key(prompt, language, model):
+    raw = '\x1f'.join([normalize_prompt(prompt), (language or '').strip().lower(), model or ''])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class GenerationCache:
+    # Two tiers: an in-process LRU in front of the SQLite generation_cache table
+    def __init__(self, ttl=86400, max_entries=1024, max_persistent_entries=10000, persistent=True):
+        self.ttl = ttl
+        self.max_persistent_entries = max_persistent_entries
+        self.persistent = persistent
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._stats_lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, prompt, language, model):
+        key = generation_cache_key(prompt, language, model)
+        result = self.memory.get(key)
+        if result is not None:
+            self._count('memory_hits')
+            return result
+
+        if self.persistent:
+            try:
+                entry = get_cached_generation(key, datetime.now().isoformat())
+            except Exception as e:
+                logger.error(f"Error reading generation cache: {str(e)}")
+                self._count('errors')
+                entry = None
+            if entry:
+                result = (entry['code'], entry['explanation'], entry['future_steps'])
+                self.memory.set(key, result)
+                self._count('persistent_hits')
+                return result
+
+        self._count('misses')
+        return None
+
+    def set(self, prompt, language, model, result):
+        key = generation_cache_key(prompt, language, model)
+        self.memory.set(key, result)
+        self._count('stores')
+
+        if self.persistent:
+            now = datetime.now()
+            try:
+                code, explanation, future_steps = result
+                save_cached_generation(
+                    key, code, explanation, future_steps, now.isoformat(),
+                    (now + timedelta(seconds=self.ttl)).isoformat(), self.max_persistent_entries
+                )
+            except Exception as e:
+                logger.error(f"Error writing generation cache: {str(e)}")
+                self._count('errors')
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['memory_hits'] + stats['persistent_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        if self.persistent:
+            try:
+                stats['persistent_entries'] = count_cached_generations()
+            except Exception as e:
+                logger.error(f"Error counting generation cache: {str(e)}")
+        return stats
+
+class SingleFlight:
+    # Concurrent callers with the same key share one in-flight call and its outcome
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'coalesced': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.stats['leaders'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            # Re-raises the leader's exception for every waiter
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
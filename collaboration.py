@@ -0,0 +1,533 @@
+import json
+import logging
+import threading
+import time
+
+from database import update_collaboration_codes
+
+logger = logging.getLogger(__name__)
+
+class CollaborationWriteBuffer:
+    # Write-behind layer for collaboration code: keeps the latest code/language per session
+    # in memory and persists dirty sessions in batches.
+    #   idle_flush  - flush a session once nobody has typed in it for this many seconds
+    #   max_delay   - upper bound on how long an edit can stay unpersisted while typing continues
+    #   interval    - how often the background flusher wakes up to check
+    def __init__(self, interval=1.0, idle_flush=2.0, max_delay=10.0, writer=update_collaboration_codes):
+        self.interval = interval
+        self.idle_flush = idle_flush
+        self.max_delay = max_delay
+        self.writer = writer
+        self.stats = {'updates': 0, 'flushes': 0, 'rows_written': 0, 'errors': 0}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='collaboration-flusher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.interval * 2)
+        self._thread = None
+        self.flush()
+
+    def update(self, session_id, code, language):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pending.get(session_id)
+            first_dirty = entry['first_dirty'] if entry else now
+            self._pending[session_id] = {
+                'code': code,
+                'language': language,
+                'first_dirty': first_dirty,
+                'last_change': now
+            }
+            self.stats['updates'] += 1
+        if self._thread is None:
+            self.start()
+
+    def get(self, session_id):
+        # Latest unflushed state for a session, or None if the database is current
+        with self._lock:
+            entry = self._pending.get(session_id)
+            return (entry['code'], entry['language']) if entry else None
+
+    def discard(self, session_id):
+        with self._lock:
+            self._pending.pop(session_id, None)
+
+    def flush(self, session_id=None):
+        with self._lock:
+            if session_id is None:
+                batch = self._pending
+                self._pending = {}
+            elif session_id in self._pending:
+                batch = {session_id: self._pending.pop(session_id)}
+            else:
+                batch = {}
+        return self._write(batch)
+
+    def flush_due(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                session_id for session_id, entry in self._pending.items()
+                if now - entry['last_change'] >= self.idle_flush
+                or now - entry['first_dirty'] >= self.max_delay
+            ]
+            batch = {session_id: self._pending.pop(session_id) for session_id in due}
+        return self._write(batch)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _write(self, batch):
+        if not batch:
+            return 0
+        with self._flush_lock:
+            try:
+                self.writer([(session_id, entry['code'], entry['language']) for session_id, entry in batch.items()])
+            except Exception as e:
+                logger.error(f"Error flushing {len(batch)} collaboration sessions: {str(e)}")
+                self.stats['errors'] += 1
+                self._requeue(batch)
+                return 0
+        self.stats['flushes'] += 1
+        self.stats['rows_written'] += len(batch)
+        return len(batch)
+
+    def _requeue(self, batch):
+        # Put failed entries back unless newer edits have arrived in the meantime
+        with self._lock:
+            for session_id, entry in batch.items():
+                self._pending.setdefault(session_id, entry)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush_due()
+            except Exception as e:
+                logger.error(f"Error in collaboration flusher: {str(e)}")
+
+# Operational transform for plain-text documents.
+# An operation is a list of components applied in order, each either
+#   {'type': 'insert', 'pos': int, 'text': str} or {'type': 'delete', 'pos': int, 'length': int}
+
+class InvalidOperation(ValueError):
+    pass
+
+def normalize_ops(ops):
+    if not isinstance(ops, list):
+        raise InvalidOperation('ops must be a list')
+    normalized = []
+    for op in ops:
+        if not isinstance(op, dict):
+            raise InvalidOperation('each op must be an object')
+        pos = op.get('pos')
+        if not isinstance(pos, int) or isinstance(pos, bool) or pos < 0:
+            raise InvalidOperation('op position must be a non-negative integer')
+        if op.get('type') == 'insert':
+            text = op.get('text')
+            if not isinstance(text, str):
+                raise InvalidOperation('insert text must be a string')
+            if text:
+                normalized.append({'type': 'insert', 'pos': pos, 'text': text})
+        elif op.get('type') == 'delete':
+            length = op.get('length')
+            if not isinstance(length, int) or isinstance(length, bool) or length < 0:
+                raise InvalidOperation('delete length must be a non-negative integer')
+            if length:
+                normalized.append({'type': 'delete', 'pos': pos, 'length': length})
+        else:
+            raise InvalidOperation(f"unknown op type: {op.get('type')}")
+    return normalized
+
+def apply_ops(text, ops):
+    for op in ops:
+        pos = op['pos']
+        if op['type'] == 'insert':
+            if pos > len(text):
+                raise InvalidOperation(f"insert at {pos} is past the end of the document ({len(text)})")
+            text = text[:pos] + op['text'] + text[pos:]
+        else:
+            if pos + op['length'] > len(text):
+                raise InvalidOperation(f"delete of {op['length']} at {pos} is past the end of the document ({len(text)})")
+            text = text[:pos] + text[pos + op['length']:]
+    return text
+
+def _transform_component(op, other, op_after_on_tie):
+    # Rewrites `op` so it applies after `other`; may split a delete in two or drop it entirely
+    pos = op['pos']
+    if other['type'] == 'insert':
+        size = len(other['text'])
+        if op['type'] == 'insert':
+            if other['pos'] < pos or (other['pos'] == pos and op_after_on_tie):
+                return [dict(op, pos=pos + size)]
+            return [dict(op)]
+        end = pos + op['length']
+        if other['pos'] <= pos:
+            return [dict(op, pos=pos + size)]
+        if other['pos'] >= end:
+            return [dict(op)]
+        # Text was inserted inside the range being deleted: keep it, delete around it
+        head = other['pos'] - pos
+        return [
+            {'type': 'delete', 'pos': pos, 'length': head},
+            {'type': 'delete', 'pos': pos + size, 'length': op['length'] - head}
+        ]
+
+    other_start = other['pos']
+    other_end = other_start + other['length']
+    if op['type'] == 'insert':
+        if pos <= other_start:
+            return [dict(op)]
+        if pos >= other_end:
+            return [dict(op, pos=pos - other['length'])]
+        return [dict(op, pos=other_start)]
+
+    end = pos + op['length']
+    if end <= other_start:
+        return [dict(op)]
+    if pos >= other_end:
+        return [dict(op, pos=pos - other['length'])]
+    overlap = min(end, other_end) - max(pos, other_start)
+    remaining = op['length'] - overlap
+    if remaining == 0:
+        return []
+    return [{'type': 'delete', 'pos': min(pos, other_start), 'length': remaining}]
+
+def transform(ops, applied):
+    # Returns (ops', applied') such that apply(apply(doc, applied), ops') == apply(apply(doc, ops), applied').
+    # `applied` was accepted first, so its inserts win position ties.
+    if not ops or not applied:
+        return ops, applied
+    if len(ops) > 1:
+        head, applied = transform(ops[:1], applied)
+        tail, applied = transform(ops[1:], applied)
+        return head + tail, applied
+    if len(applied) > 1:
+        ops, head = transform(ops, applied[:1])
+        ops, tail = transform(ops, applied[1:])
+        return ops, head + tail
+    return (
+        _transform_component(ops[0], applied[0], op_after_on_tie=True),
+        _transform_component(applied[0], ops[0], op_after_on_tie=False)
+    )
+
+class StaleRevision(Exception):
+    pass
+
+class CollaborationDocument:
+    # Authoritative copy of a room's document plus the recent operation log used for transforms
+    def __init__(self, text='', language='python', revision=0, history_limit=500):
+        self.text = text
+        self.language = language
+        self.revision = revision
+        self.history = []
+        self.history_limit = history_limit
+        # Reentrant so callers can hold it across apply() and the broadcast that must follow in order
+        self.lock = threading.RLock()
+
+    @property
+    def base_revision(self):
+        return self.revision - len(self.history)
+
+    def apply(self, revision, ops, language=None):
+        # Transforms client ops made at `revision` over everything accepted since, then applies them
+        if not isinstance(revision, int) or isinstance(revision, bool):
+            raise InvalidOperation('revision must be an integer')
+        with self.lock:
+            ops, text = self._rebase(revision, normalize_ops(ops))
+            self._commit(text, ops, language)
+            return self.revision, ops
+
+    def replace(self, text, language=None):
+        # Full-document update from a client that doesn't speak the op protocol
+        with self.lock:
+            ops = replacement_ops(self.text, text)
+            self._commit(text, ops, language)
+            return self.revision, ops
+
+    def snapshot(self):
+        with self.lock:
+            return {'code': self.text, 'language': self.language, 'revision': self.revision}
+
+    def _rebase(self, revision, ops):
+        if revision > self.revision or revision < self.base_revision:
+            raise StaleRevision(f"revision {revision} is outside {self.base_revision}..{self.revision}")
+        for concurrent in self.history[revision - self.base_revision:]:
+            ops, _ = transform(ops, concurrent)
+        return ops, apply_ops(self.text, ops)
+
+    def _commit(self, text, ops, language=None):
+        self.text = text
+        if language:
+            self.language = language
+        self._record(ops)
+
+    def _record(self, ops):
+        self.revision += 1
+        self.history.append(ops)
+        if len(self.history) > self.history_limit:
+            del self.history[:len(self.history) - self.history_limit]
+
+def replacement_ops(old_text, new_text):
+    ops = []
+    if old_text:
+        ops.append({'type': 'delete', 'pos': 0, 'length': len(old_text)})
+    if new_text:
+        ops.append({'type': 'insert', 'pos': 0, 'text': new_text})
+    return ops
+
+class DocumentRegistry:
+    def __init__(self, history_limit=500):
+        self.history_limit = history_limit
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            return self._documents.get(session_id)
+
+    def get_or_create(self, session_id, loader):
+        # loader() returns (code, language) for a room that isn't in memory yet
+        with self._lock:
+            document = self._documents.get(session_id)
+            if document is None:
+                document = self._create(session_id, loader)
+                self._documents[session_id] = document
+            return document
+
+    def drop(self, session_id):
+        with self._lock:
+            return self._documents.pop(session_id, None)
+
+    def _create(self, session_id, loader):
+        code, language = loader()
+        return CollaborationDocument(code or '', language or 'python', history_limit=self.history_limit)
+
+    def __len__(self):
+        return len(self._documents)
+
+# Multi-process mode: every worker keeps a local CollaborationDocument, but revisions are assigned
+# by appending to a shared op log in Redis. An append only succeeds against the latest revision;
+# a worker that lost the race pulls the ops it missed, rebases and tries again.
+#   {prefix}:doc:{id}:rev   - current revision
+#   {prefix}:doc:{id}:log   - JSON entries {'ops': [...], 'language': str|null}, the last history_limit revisions
+#   {prefix}:doc:{id}:state - hash with a periodic text snapshot (text, language, revision)
+
+SEED_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4])
+redis.call('HSET', KEYS[3], 'text', ARGV[2], 'language', ARGV[3], 'revision', ARGV[1])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 1
+'''
+
+FETCH_SCRIPT = '''
+local rev = tonumber(redis.call('GET', KEYS[1]))
+if not rev then
+    return {-1}
+end
+local missing = rev - tonumber(ARGV[1])
+if missing > 0 and missing <= redis.call('LLEN', KEYS[2]) then
+    return {rev, unpack(redis.call('LRANGE', KEYS[2], -missing, -1))}
+end
+return {rev}
+'''
+
+APPEND_SCRIPT = '''
+local rev = tonumber(redis.call('GET', KEYS[1]))
+if not rev then
+    return {0, -1}
+end
+if rev ~= tonumber(ARGV[1]) then
+    local missing = rev - tonumber(ARGV[1])
+    if missing > 0 and missing <= redis.call('LLEN', KEYS[2]) then
+        return {0, rev, unpack(redis.call('LRANGE', KEYS[2], -missing, -1))}
+    end
+    return {0, rev}
+end
+rev = rev + 1
+redis.call('RPUSH', KEYS[2], ARGV[2])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[3]), -1)
+redis.call('SET', KEYS[1], rev, 'EX', ARGV[4])
+if ARGV[5] == '1' then
+    redis.call('HSET', KEYS[3], 'text', ARGV[6], 'language', ARGV[7], 'revision', rev)
+end
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return {1, rev}
+'''
+
+LOAD_SCRIPT = '''
+local rev = redis.call('GET', KEYS[1])
+if not rev then
+    return {}
+end
+local state = redis.call('HMGET', KEYS[3], 'text', 'language', 'revision')
+return {rev, state[1], state[2], state[3], unpack(redis.call('LRANGE', KEYS[2], 0, -1))}
+'''
+
+class SharedCollaborationDocument(CollaborationDocument):
+    def __init__(self, store, session_id, text='', language='python', revision=0, history_limit=500):
+        super().__init__(text, language, revision, history_limit)
+        self.store = store
+        self.keys = store.document_keys(session_id)
+
+    def apply(self, revision, ops, language=None):
+        if not isinstance(revision, int) or isinstance(revision, bool):
+            raise InvalidOperation('revision must be an integer')
+        with self.lock:
+            if revision > self.revision:
+                # The client saw a revision committed through another worker
+                self.sync()
+            ops = normalize_ops(ops)
+            while True:
+                rebased, text = self._rebase(revision, ops)
+                if self._publish(rebased, text, language):
+                    return self.revision, rebased
+
+    def replace(self, text, language=None):
+        with self.lock:
+            while True:
+                ops = replacement_ops(self.text, text)
+                if self._publish(ops, text, language):
+                    return self.revision, ops
+
+    def snapshot(self):
+        with self.lock:
+            self.sync()
+            return super().snapshot()
+
+    def sync(self):
+        with self.lock:
+            self._integrate(self.store.fetch(self.keys, self.revision))
+
+    def load(self):
+        # Rebuilds local state from the shared snapshot and op log; False if the room has no shared state
+        result = self.store.load(self.keys)
+        if not result:
+            return False
+        revision, text, language, snapshot_revision, entries = result
+        # The log holds the newest entries; the ones after the snapshot bring its text up to date
+        replay_from = len(entries) - (revision - snapshot_revision)
+        if replay_from < 0:
+            raise RuntimeError(f"collaboration log for {self.keys[0]} does not reach back to its snapshot")
+        self.text = text
+        self.language = language
+        self.history = []
+        for index, entry in enumerate(entries):
+            if index >= replay_from:
+                self.text = apply_ops(self.text, entry['ops'])
+                if entry.get('language'):
+                    self.language = entry['language']
+            self.history.append(entry['ops'])
+        self.revision = revision
+        return True
+
+    def seed(self):
+        # Publishes the local state as the room's shared state unless another worker got there first
+        if not self.store.seed(self.keys, self.text, self.language, self.revision):
+            self.load()
+
+    def _publish(self, ops, text, language):
+        committed, result = self.store.append(self.keys, self.revision, ops, text, language or self.language)
+        if committed:
+            self._commit(text, ops, language)
+            return True
+        self._integrate(result)
+        return False
+
+    def _integrate(self, result):
+        revision, entries = result
+        if revision < 0:
+            # Shared state expired or was purged while this worker still had the room open
+            self.seed()
+        elif revision > self.revision and len(entries) == revision - self.revision:
+            for entry in entries:
+                self._commit(apply_ops(self.text, entry['ops']), entry['ops'], entry.get('language'))
+        elif revision != self.revision:
+            self.load()
+
+class RedisDocumentStore:
+    def __init__(self, client, history_limit=500, snapshot_every=50, ttl=86400, prefix='collab'):
+        self.client = client
+        self.history_limit = history_limit
+        # Snapshots must land inside the retained log so load() can always replay from one
+        self.snapshot_every = max(1, min(snapshot_every, history_limit - 1))
+        self.ttl = ttl
+        self.prefix = prefix
+        self._seed = client.register_script(SEED_SCRIPT)
+        self._fetch = client.register_script(FETCH_SCRIPT)
+        self._append = client.register_script(APPEND_SCRIPT)
+        self._load = client.register_script(LOAD_SCRIPT)
+
+    def document_keys(self, session_id):
+        base = f"{self.prefix}:doc:{session_id}"
+        return [f"{base}:rev", f"{base}:log", f"{base}:state"]
+
+    def seed(self, keys, text, language, revision):
+        return bool(self._seed(keys=keys, args=[revision, text, language, self.ttl]))
+
+    def fetch(self, keys, revision):
+        result = self._fetch(keys=keys, args=[revision])
+        return int(result[0]), [json.loads(entry) for entry in result[1:]]
+
+    def append(self, keys, revision, ops, text, language):
+        snapshot = (revision + 1) % self.snapshot_every == 0
+        entry = json.dumps({'ops': ops, 'language': language})
+        result = self._append(keys=keys, args=[
+            revision, entry, self.history_limit, self.ttl,
+            '1' if snapshot else '0', text if snapshot else '', language
+        ])
+        if int(result[0]) == 1:
+            return True, None
+        return False, (int(result[1]), [json.loads(entry) for entry in result[2:]])
+
+    def load(self, keys):
+        result = self._load(keys=keys)
+        if not result:
+            return None
+        revision, text, language, snapshot_revision = result[:4]
+        return int(revision), text or '', language or 'python', int(snapshot_revision or 0), [json.loads(entry) for entry in result[4:]]
+
+    def delete(self, keys):
+        self.client.delete(*keys)
+
+class SharedDocumentRegistry(DocumentRegistry):
+    def __init__(self, store, history_limit=500):
+        super().__init__(history_limit)
+        self.store = store
+
+    def drop(self, session_id):
+        # Ending a room ends it for every worker, not just this one
+        document = super().drop(session_id)
+        try:
+            self.store.delete(self.store.document_keys(session_id))
+        except Exception as e:
+            logger.error(f"Error deleting shared state for collaboration session {session_id}: {str(e)}")
+        return document
+
+    def _create(self, session_id, loader):
+        document = SharedCollaborationDocument(self.store, session_id, history_limit=self.history_limit)
+        if not document.load():
+            code, language = loader()
+            document.text = code or ''
+            document.language = language or 'python'
+            document.seed()
+        return document
@@ -1,65 +1,280 @@
+import base64
+import hashlib
+import html
+import json
+import os
+import queue
 import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
 
-def get_db():
-    conn = sqlite3.connect('code_generator.db')
+import metrics
+
+# Database configuration
+DATABASE_PATH = os.path.abspath(os.getenv(
+    'DATABASE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code_generator.db')
+))
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '10'))
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', '10'))
+DATABASE_BUSY_TIMEOUT_MS = int(os.getenv('DATABASE_BUSY_TIMEOUT_MS', '5000'))
+DATABASE_CACHE_SIZE_KB = int(os.getenv('DATABASE_CACHE_SIZE_KB', '20000'))
+DATABASE_MMAP_SIZE = int(os.getenv('DATABASE_MMAP_SIZE', str(256 * 1024 * 1024)))
+CODE_BLOB_COMPRESSION_LEVEL = int(os.getenv('CODE_BLOB_COMPRESSION_LEVEL', '6'))
+
+# Every public helper is timed, including any wait for a pooled connection
+helper_seconds = metrics.histogram(
+    'db_helper_duration_seconds', 'Time spent in database.py helpers', ['helper'])
+
+def timed_helper(func):
+    return helper_seconds.timed(func.__name__)(func)
+
+# From each pooled connection's total_changes, so UPDATEs (collaboration flushes, refcounts, cache
+# hits) and DELETEs count as well as INSERTs; changes made by triggers are included
+rows_changed = metrics.counter('db_rows_changed_total', 'Rows inserted, updated or deleted through pooled connections')
+
+# Code is stored once per distinct content in code_blobs, zlib-compressed and keyed by its sha256
+def code_digest(code):
+    return hashlib.sha256(code.encode('utf-8')).hexdigest() if code is not None else None
+
+def compress_code(code):
+    return zlib.compress(code.encode('utf-8'), CODE_BLOB_COMPRESSION_LEVEL) if code is not None else None
+
+def decompress_code(data):
+    return zlib.decompress(data).decode('utf-8') if data is not None else None
+
+# server.py sets this under eventlet/gevent to a function that runs a call on a real OS thread
+# (eventlet's tpool, gevent's threadpool). Pooled connections then send every SQLite call through
+# it, so a slow query or a busy_timeout wait doesn't stall the event loop and every socket on it.
+run_blocking = None
+
+class OffloadedCalls:
+    # Wraps a connection or cursor: method calls go through run_blocking and cursors they return
+    # are wrapped the same way. Iterating fetches every row in one call.
+    def __init__(self, target, run):
+        self._target = target
+        self._run = run
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = self._run(attr, *args, **kwargs)
+            if isinstance(result, sqlite3.Cursor):
+                return OffloadedCalls(result, self._run)
+            return result
+        return call
+
+    def __iter__(self):
+        return iter(self._run(self._target.fetchall))
+
+def get_db(path=None):
+    # Opens a new connection; helpers should borrow pooled ones through connection()/transaction()
+    conn = sqlite3.connect(
+        path or DATABASE_PATH,
+        timeout=DATABASE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        isolation_level=None  # autocommit; multi-statement work goes through transaction()
+    )
     conn.row_factory = sqlite3.Row
+    # Used only by the blob migration; views and triggers stay plain SQL so any client can write
+    conn.create_function('code_digest', 1, code_digest, deterministic=True)
+    conn.create_function('code_compress', 1, compress_code, deterministic=True)
+    conn.execute(f'PRAGMA busy_timeout = {DATABASE_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{DATABASE_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {DATABASE_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    if run_blocking is not None:
+        return OffloadedCalls(conn, run_blocking)
     return conn
 
-def init_db():
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Create snippets table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS snippets (
+class ConnectionPool:
+    def __init__(self, path, size, timeout):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return get_db(self.path)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"Timed out waiting for a database connection after {self.timeout}s")
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE_PATH, DATABASE_POOL_SIZE, DATABASE_POOL_TIMEOUT)
+    return _pool
+
+def pool_connections():
+    if _pool is None:
+        return {}
+    idle = _pool._idle.qsize()
+    return {('idle',): idle, ('in_use',): max(0, _pool._created - idle)}
+
+metrics.callback('db_pool_connections', 'Pooled SQLite connections by state', pool_connections, ['state'])
+
+def close_pool():
+    if _pool is not None:
+        _pool.close_all()
+
+@contextmanager
+def connection():
+    # Reentrant per thread, so a helper called inside transaction() shares its connection
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        yield conn
+        return
+
+    pool = get_pool()
+    conn = pool.acquire()
+    _local.conn = conn
+    changes = conn.total_changes
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        changed = conn.total_changes - changes
+        if changed:
+            rows_changed.inc(amount=changed)
+        pool.release(conn)
+
+@contextmanager
+def transaction():
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+# Tables whose code lives in code_blobs. Their {table}_with_code views put the compressed blob
+# in the code column's position as code_data; code_row() decompresses it back into code.
+CODE_TABLES = {
+    'snippets': {
+        'columns': ['id', 'title', 'description', 'code', 'language', 'created_at'],
+        'schema': '''
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
             description TEXT,
-            code TEXT NOT NULL,
+            code_hash TEXT NOT NULL REFERENCES code_blobs(hash),
             language TEXT NOT NULL,
             created_at TEXT NOT NULL
-        )
-    ''')
-    
-    # Create history table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS generation_history (
+        '''
+    },
+    'generation_history': {
+        'columns': ['id', 'prompt', 'code', 'language', 'explanation', 'future_steps', 'created_at'],
+        'schema': '''
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             prompt TEXT NOT NULL,
-            code TEXT NOT NULL,
+            code_hash TEXT NOT NULL REFERENCES code_blobs(hash),
             language TEXT NOT NULL,
             explanation TEXT,
             future_steps TEXT,
             created_at TEXT NOT NULL
-        )
-    ''')
-    
-    # Create shared_code table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS shared_code (
+        '''
+    },
+    'shared_code': {
+        'columns': ['id', 'code', 'language', 'created_at', 'expires_at'],
+        'schema': '''
             id TEXT PRIMARY KEY,
-            code TEXT NOT NULL,
+            code_hash TEXT NOT NULL REFERENCES code_blobs(hash),
             language TEXT NOT NULL,
             created_at TEXT NOT NULL,
             expires_at TEXT NOT NULL
-        )
-    ''')
-    
-    # Create collaboration_sessions table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS collaboration_sessions (
+        '''
+    },
+    'collaboration_sessions': {
+        'columns': ['id', 'creator_name', 'code', 'language', 'created_at', 'active'],
+        'schema': '''
             id TEXT PRIMARY KEY,
             creator_name TEXT NOT NULL,
-            code TEXT,
+            code_hash TEXT REFERENCES code_blobs(hash),
             language TEXT,
             created_at TEXT NOT NULL,
             active INTEGER DEFAULT 1
+        '''
+    }
+}
+
+def create_schema(conn):
+    # Create code_blobs table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS code_blobs (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
         )
     ''')
-    
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_code_blobs_unreferenced
+        ON code_blobs (hash) WHERE refcount <= 0
+    ''')
+
+    # Create snippets, generation_history, shared_code and collaboration_sessions tables
+    for table, definition in CODE_TABLES.items():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition['schema']})")
+    migrate_code_columns(conn)
+    for table in CODE_TABLES:
+        create_code_references(conn, table)
+
     # Create collaboration_messages table
-    c.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS collaboration_messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             session_id TEXT NOT NULL,
@@ -69,129 +284,688 @@ def init_db():
             FOREIGN KEY (session_id) REFERENCES collaboration_sessions(id)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
 
+    # Create generation_cache table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            cache_key TEXT PRIMARY KEY,
+            code TEXT NOT NULL,
+            explanation TEXT,
+            future_steps TEXT,
+            created_at TEXT NOT NULL,
+            last_accessed TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_cache_last_accessed
+        ON generation_cache (last_accessed)
+    ''')
+
+    # Create shared_code_renders table: highlighted HTML keyed by content, not by share
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shared_code_renders (
+            content_hash TEXT NOT NULL,
+            language TEXT NOT NULL,
+            theme TEXT NOT NULL,
+            html TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (content_hash, language, theme)
+        )
+    ''')
+
+    # Indexes backing the keyset-paginated listings
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_history_created
+        ON generation_history (created_at DESC, id DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_history_language_created
+        ON generation_history (language, created_at DESC, id DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_snippets_created
+        ON snippets (created_at DESC, id DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_snippets_language_created
+        ON snippets (language, created_at DESC, id DESC)
+    ''')
+
+    # Indexes backing the retention sweeps in maintenance.py
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_shared_code_expires
+        ON shared_code (expires_at)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_collaboration_messages_session
+        ON collaboration_messages (session_id, timestamp)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_collaboration_messages_timestamp
+        ON collaboration_messages (timestamp)
+    ''')
+
+    create_search_index(conn)
+
+def rebuild_code_views_and_search(conn):
+    # Earlier views and search triggers called an app-registered SQL function, so writes from
+    # the sqlite3 shell or another process failed. Recreate both in plain SQL and reindex.
+    drop_search_index(conn)
+    for table in CODE_TABLES:
+        conn.execute(f'DROP VIEW IF EXISTS {table}_with_code')
+        create_code_references(conn, table)
+    create_search_index(conn)
+
+def add_session_ended_at(conn):
+    # Retention of ended sessions counts from when they ended. Sessions ended before this column
+    # existed get their last activity, which is what retention was measured from until now.
+    if 'ended_at' not in table_columns(conn, 'collaboration_sessions'):
+        conn.execute('ALTER TABLE collaboration_sessions ADD COLUMN ended_at TEXT')
+    conn.execute('''
+        UPDATE collaboration_sessions
+        SET ended_at = MAX(created_at, COALESCE((
+            SELECT MAX(timestamp) FROM collaboration_messages m
+            WHERE m.session_id = collaboration_sessions.id
+        ), created_at))
+        WHERE active = 0 AND ended_at IS NULL
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_collaboration_sessions_ended ON collaboration_sessions (ended_at)')
+
+def enable_incremental_vacuum(conn):
+    # Lets the maintenance sweeper shrink the file without a full VACUUM. Switching auto_vacuum
+    # mode on an existing file only takes effect through a VACUUM, which also gives back the
+    # space freed by moving inline code into code_blobs.
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+# Schema changes, applied in order and recorded in schema_migrations so each runs once per
+# database rather than on every process start: (version, name, migrate(conn), transactional).
+# VACUUM can't run inside a transaction, so those steps are marked non-transactional.
+# Version 1 is idempotent so databases created before this table existed upgrade cleanly.
+MIGRATIONS = [
+    (1, 'initial_schema', create_schema, True),
+    (2, 'incremental_auto_vacuum', enable_incremental_vacuum, False),
+    (3, 'plain_sql_views_and_search', rebuild_code_views_and_search, True),
+    (4, 'collaboration_sessions_ended_at', add_session_ended_at, True)
+]
+
+def applied_migrations(conn):
+    return {row['version'] for row in conn.execute('SELECT version FROM schema_migrations')}
+
+def init_db():
+    # Returns the names of the migrations this call applied; an up-to-date database costs one query
+    with connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        applied = applied_migrations(conn)
+
+    ran = []
+    for version, name, migrate, transactional in MIGRATIONS:
+        if version in applied:
+            continue
+        with (transaction() if transactional else connection()) as conn:
+            # Another process may have applied it while this one waited for the write lock
+            if version in applied_migrations(conn):
+                continue
+            migrate(conn)
+            conn.execute(
+                'INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                (version, name, datetime.now().isoformat())
+            )
+        ran.append(name)
+    return ran
+
+def table_columns(conn, table):
+    return [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def migrate_code_columns(conn):
+    # Moves inline code columns from databases created before code_blobs existed into the blob store.
+    # SQLite can't drop a column everywhere we run, so each table is rebuilt under its new schema.
+    legacy = [table for table in CODE_TABLES if 'code' in table_columns(conn, table)]
+    if not legacy:
+        return False
+
+    now = datetime.now().isoformat()
+    # The search index triggers on the tables being rebuilt; it is recreated and backfilled afterwards
+    drop_search_index(conn)
+    for table in legacy:
+        columns = [column for column in CODE_TABLES[table]['columns'] if column != 'code']
+        column_list = ', '.join(columns)
+        conn.execute(f'''
+            INSERT OR IGNORE INTO code_blobs (hash, data, size, refcount, created_at)
+            SELECT code_digest(code), code_compress(code), length(CAST(code AS BLOB)), 0, ?
+            FROM {table} WHERE code IS NOT NULL
+        ''', (now,))
+        sequence = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        conn.execute(f"CREATE TABLE {table}_migrated ({CODE_TABLES[table]['schema']})")
+        conn.execute(f'''
+            INSERT INTO {table}_migrated ({column_list}, code_hash)
+            SELECT {column_list}, code_digest(code) FROM {table}
+        ''')
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_migrated RENAME TO {table}')
+        if sequence:
+            conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (sequence['seq'], table))
+
+    # Rows were copied before the reference triggers existed, so count references from scratch
+    counts = ' + '.join(f'(SELECT COUNT(*) FROM {table} WHERE code_hash = code_blobs.hash)' for table in CODE_TABLES)
+    conn.execute(f'UPDATE code_blobs SET refcount = {counts}')
+    return True
+
+def create_code_references(conn, table):
+    # Reference counts on code_blobs follow inserts, deletes and code changes; unreferenced blobs
+    # are removed later by collect_code_blobs(), after any search-index triggers have read them
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_code_hash ON {table} (code_hash)')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_code_insert AFTER INSERT ON {table}
+        WHEN new.code_hash IS NOT NULL BEGIN
+            UPDATE code_blobs SET refcount = refcount + 1 WHERE hash = new.code_hash;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_code_delete AFTER DELETE ON {table}
+        WHEN old.code_hash IS NOT NULL BEGIN
+            UPDATE code_blobs SET refcount = refcount - 1 WHERE hash = old.code_hash;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_code_update AFTER UPDATE OF code_hash ON {table}
+        WHEN old.code_hash IS NOT new.code_hash BEGIN
+            UPDATE code_blobs SET refcount = refcount - 1 WHERE hash = old.code_hash;
+            UPDATE code_blobs SET refcount = refcount + 1 WHERE hash = new.code_hash;
+        END
+    ''')
+
+    select_list = ', '.join(
+        'b.data AS code_data' if column == 'code' else f't.{column}'
+        for column in CODE_TABLES[table]['columns']
+    )
+    conn.execute(f'''
+        CREATE VIEW IF NOT EXISTS {table}_with_code AS
+        SELECT {select_list}, t.code_hash
+        FROM {table} t LEFT JOIN code_blobs b ON b.hash = t.code_hash
+    ''')
+
+def store_code(conn, code):
+    # Returns the blob hash for `code`, writing the blob only if this content hasn't been seen.
+    # Call inside the transaction that writes the referencing row so garbage collection can't race it.
+    if code is None:
+        return None
+    digest = code_digest(code)
+    if not conn.execute('SELECT 1 FROM code_blobs WHERE hash = ?', (digest,)).fetchone():
+        conn.execute('''
+            INSERT OR IGNORE INTO code_blobs (hash, data, size, refcount, created_at)
+            VALUES (?, ?, ?, 0, ?)
+        ''', (digest, compress_code(code), len(code.encode('utf-8')), datetime.now().isoformat()))
+    return digest
+
+def code_row(row):
+    # Turns a *_with_code view row into a dict with the decompressed code under 'code'
+    if row is None:
+        return None
+    result = {}
+    for key in row.keys():
+        if key == 'code_data':
+            result['code'] = decompress_code(row[key])
+        else:
+            result[key] = row[key]
+    return result
+
+@timed_helper
+def collect_code_blobs(hashes=None):
+    # Deletes blobs no row references any more, optionally only among `hashes`
+    with transaction() as conn:
+        if hashes is None:
+            return conn.execute('DELETE FROM code_blobs WHERE refcount <= 0').rowcount
+        hashes = [digest for digest in set(hashes) if digest]
+        if not hashes:
+            return 0
+        placeholders = ', '.join('?' * len(hashes))
+        return conn.execute(
+            f'DELETE FROM code_blobs WHERE refcount <= 0 AND hash IN ({placeholders})', hashes
+        ).rowcount
+
+# Full-text search index: FTS5 tables holding their own copy of the text. Triggers keep the
+# plain columns in sync; code is written by the save helpers (index_code), since triggers can
+# only see the compressed blob and must not depend on app-registered SQL functions.
+SEARCH_INDEXES = {
+    'snippets_fts': ('snippets', ['title', 'description', 'code']),
+    'generation_history_fts': ('generation_history', ['prompt', 'code'])
+}
+
+def drop_search_index(conn):
+    for fts_table in SEARCH_INDEXES:
+        for action in ('insert', 'delete', 'update'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {fts_table}_{action}')
+        conn.execute(f'DROP TABLE IF EXISTS {fts_table}')
+
+def create_search_index(conn):
+    for fts_table, (table, columns) in SEARCH_INDEXES.items():
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+        ).fetchone()
+        plain = [column for column in columns if column != 'code']
+        plain_list = ', '.join(plain)
+        new_values = ', '.join(f'new.{column}' for column in plain)
+        assignments = ', '.join(f'{column} = new.{column}' for column in plain)
+
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                {', '.join(columns)}, tokenize='unicode61'
+            )
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts_table} (rowid, {plain_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM {fts_table} WHERE rowid = old.id;
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF {plain_list} ON {table} BEGIN
+                UPDATE {fts_table} SET {assignments} WHERE rowid = old.id;
+            END
+        ''')
+
+        # Index rows that predate the search index
+        if not exists:
+            rows = conn.execute(f'''
+                SELECT t.id, {', '.join(f't.{column}' for column in plain)}, b.data
+                FROM {table} t LEFT JOIN code_blobs b ON b.hash = t.code_hash
+            ''').fetchall()
+            placeholders = ', '.join('?' * (len(columns) + 1))
+            conn.executemany(
+                f'INSERT INTO {fts_table} (rowid, {plain_list}, code) VALUES ({placeholders})',
+                [tuple(row)[:-1] + (decompress_code(row['data']),) for row in rows]
+            )
+
+def index_code(conn, fts_table, row_id, code):
+    # Call in the transaction that inserted the row, after its insert trigger has added the plain columns
+    conn.execute(f'UPDATE {fts_table} SET code = ? WHERE rowid = ?', (code, row_id))
+
+@timed_helper
 def save_snippet(title, description, code, language):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO snippets (title, description, code, language, created_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (title, description, code, language, datetime.now().isoformat()))
-    conn.commit()
-    snippet_id = c.lastrowid
-    conn.close()
-    return snippet_id
+    with transaction() as conn:
+        c = conn.execute('''
+            INSERT INTO snippets (title, description, code_hash, language, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (title, description, store_code(conn, code), language, datetime.now().isoformat()))
+        index_code(conn, 'snippets_fts', c.lastrowid, code)
+        return c.lastrowid
 
+@timed_helper
 def get_snippets():
-    conn = get_db()
-    snippets = conn.execute('SELECT * FROM snippets ORDER BY created_at DESC').fetchall()
-    conn.close()
-    return [dict(snippet) for snippet in snippets]
+    with connection() as conn:
+        snippets = conn.execute('SELECT * FROM snippets_with_code ORDER BY created_at DESC').fetchall()
+    return [code_row(snippet) for snippet in snippets]
 
+@timed_helper
 def get_snippet(snippet_id):
-    conn = get_db()
-    snippet = conn.execute('SELECT * FROM snippets WHERE id = ?', (snippet_id,)).fetchone()
-    conn.close()
-    return dict(snippet) if snippet else None
+    with connection() as conn:
+        snippet = conn.execute('SELECT * FROM snippets_with_code WHERE id = ?', (snippet_id,)).fetchone()
+    return code_row(snippet)
 
+@timed_helper
 def save_generation_history(prompt, code, language, explanation, future_steps):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO generation_history 
-        (prompt, code, language, explanation, future_steps, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (prompt, code, language, explanation, future_steps, datetime.now().isoformat()))
-    conn.commit()
-    history_id = c.lastrowid
-    conn.close()
-    return history_id
+    with transaction() as conn:
+        c = conn.execute('''
+            INSERT INTO generation_history 
+            (prompt, code_hash, language, explanation, future_steps, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (prompt, store_code(conn, code), language, explanation, future_steps, datetime.now().isoformat()))
+        index_code(conn, 'generation_history_fts', c.lastrowid, code)
+        return c.lastrowid
 
+@timed_helper
 def get_generation_history():
-    conn = get_db()
-    history = conn.execute('SELECT * FROM generation_history ORDER BY created_at DESC').fetchall()
-    conn.close()
-    return [dict(entry) for entry in history]
+    with connection() as conn:
+        history = conn.execute('SELECT * FROM generation_history_with_code ORDER BY created_at DESC').fetchall()
+    return [code_row(entry) for entry in history]
+
+@timed_helper
+def get_generation_history_item(history_id):
+    with connection() as conn:
+        entry = conn.execute('SELECT * FROM generation_history_with_code WHERE id = ?', (history_id,)).fetchone()
+    return code_row(entry)
+
+# Pagination functions
+HISTORY_SUMMARY_COLUMNS = 'id, prompt, language, created_at'
+SNIPPET_SUMMARY_COLUMNS = 'id, title, description, language, created_at'
+
+def encode_cursor(row):
+    raw = json.dumps([row['created_at'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def _get_page(table, columns, cursor=None, limit=50, language=None):
+    # Keyset pagination on (created_at, id) so deep pages cost the same as the first one
+    clauses = []
+    params = []
+    if language:
+        clauses.append('language = ?')
+        params.append(language)
+    if cursor:
+        clauses.append('(created_at, id) < (?, ?)')
+        params.extend(decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+    with connection() as conn:
+        rows = conn.execute(f'''
+            SELECT {columns} FROM {table}
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', params + [limit + 1]).fetchall()
+
+    items = [code_row(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(items[-1]) if len(rows) > limit else None
+    return items, next_cursor
+
+@timed_helper
+def get_generation_history_page(cursor=None, limit=50, language=None, summary=True):
+    # Summaries never touch code_blobs; full rows decompress only the page being returned
+    if summary:
+        return _get_page('generation_history', HISTORY_SUMMARY_COLUMNS, cursor, limit, language)
+    return _get_page('generation_history_with_code', '*', cursor, limit, language)
+
+@timed_helper
+def get_snippets_page(cursor=None, limit=50, language=None, summary=True):
+    if summary:
+        return _get_page('snippets', SNIPPET_SUMMARY_COLUMNS, cursor, limit, language)
+    return _get_page('snippets_with_code', '*', cursor, limit, language)
+
+# Search functions
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+def build_match_query(query):
+    # Quote every term so user input can't produce FTS5 syntax errors; the last term matches as a prefix
+    terms = [term.replace('"', '""') for term in query.split()]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def render_highlight(text):
+    # Escape stored content first, then turn the FTS markers into <mark> tags
+    if text is None:
+        return None
+    return html.escape(text).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+@timed_helper
+def search_code(query, kind='all', language=None, limit=20, offset=0):
+    match = build_match_query(query)
+    if not match:
+        return []
 
+    markers = f"'{HIGHLIGHT_START}', '{HIGHLIGHT_END}'"
+    selects = []
+    params = []
+    language_clause = 'AND t.language = ?' if language else ''
+    if kind in ('all', 'snippets'):
+        selects.append(f'''
+            SELECT 'snippet' AS type, t.id, t.language, t.created_at,
+                   highlight(snippets_fts, 0, {markers}) AS title,
+                   snippet(snippets_fts, 1, {markers}, '...', 24) AS description,
+                   snippet(snippets_fts, 2, {markers}, '...', 32) AS code,
+                   bm25(snippets_fts, 10.0, 4.0, 1.0) AS rank
+            FROM snippets_fts JOIN snippets t ON t.id = snippets_fts.rowid
+            WHERE snippets_fts MATCH ? {language_clause}
+        ''')
+        params.extend([match] + ([language] if language else []))
+    if kind in ('all', 'history'):
+        selects.append(f'''
+            SELECT 'history' AS type, t.id, t.language, t.created_at,
+                   highlight(generation_history_fts, 0, {markers}) AS title,
+                   NULL AS description,
+                   snippet(generation_history_fts, 1, {markers}, '...', 32) AS code,
+                   bm25(generation_history_fts, 6.0, 1.0) AS rank
+            FROM generation_history_fts JOIN generation_history t ON t.id = generation_history_fts.rowid
+            WHERE generation_history_fts MATCH ? {language_clause}
+        ''')
+        params.extend([match] + ([language] if language else []))
+    if not selects:
+        raise ValueError(f"Unknown search type: {kind}")
+
+    with connection() as conn:
+        rows = conn.execute(
+            ' UNION ALL '.join(selects) + ' ORDER BY rank LIMIT ? OFFSET ?',
+            params + [limit, offset]
+        ).fetchall()
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        for field in ('title', 'description', 'code'):
+            result[field] = render_highlight(result[field])
+        results.append(result)
+    return results
+
+@timed_helper
 def save_shared_code(share_id, code, language, expires_at):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO shared_code (id, code, language, created_at, expires_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (share_id, code, language, datetime.now().isoformat(), expires_at))
-    conn.commit()
-    conn.close()
+    # Sharing code that already has a live share returns that share's id instead of a new one
+    now = datetime.now().isoformat()
+    with transaction() as conn:
+        code_hash = store_code(conn, code)
+        existing = conn.execute('''
+            SELECT id FROM shared_code
+            WHERE code_hash = ? AND language = ? AND expires_at > ?
+            ORDER BY expires_at DESC LIMIT 1
+        ''', (code_hash, language, now)).fetchone()
+        if existing:
+            conn.execute(
+                'UPDATE shared_code SET expires_at = MAX(expires_at, ?) WHERE id = ?', (expires_at, existing['id'])
+            )
+            return existing['id']
+        conn.execute('''
+            INSERT INTO shared_code (id, code_hash, language, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (share_id, code_hash, language, now, expires_at))
     return share_id
 
+@timed_helper
 def get_shared_code(share_id):
-    conn = get_db()
-    shared = conn.execute('SELECT * FROM shared_code WHERE id = ?', (share_id,)).fetchone()
-    conn.close()
-    return dict(shared) if shared else None
+    with connection() as conn:
+        shared = conn.execute('SELECT * FROM shared_code_with_code WHERE id = ?', (share_id,)).fetchone()
+    return code_row(shared)
+
+@timed_helper
+def get_shared_code_render(content_hash, language, theme):
+    with connection() as conn:
+        row = conn.execute(
+            'SELECT html FROM shared_code_renders WHERE content_hash = ? AND language = ? AND theme = ?',
+            (content_hash, language, theme)
+        ).fetchone()
+    return row['html'] if row else None
+
+@timed_helper
+def save_shared_code_render(content_hash, language, theme, html):
+    with connection() as conn:
+        conn.execute('''
+            INSERT OR IGNORE INTO shared_code_renders (content_hash, language, theme, html, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (content_hash, language, theme, html, datetime.now().isoformat()))
 
 # Collaboration functions
+@timed_helper
 def create_collaboration_session(session_id, creator_name):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO collaboration_sessions (id, creator_name, created_at)
-        VALUES (?, ?, ?)
-    ''', (session_id, creator_name, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    # Reopens the session if it was ended, keeping its code
+    with connection() as conn:
+        conn.execute('''
+            INSERT INTO collaboration_sessions (id, creator_name, created_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET active = 1, ended_at = NULL
+        ''', (session_id, creator_name, datetime.now().isoformat()))
 
+@timed_helper
 def get_collaboration_session(session_id):
-    conn = get_db()
-    session = conn.execute(
-        'SELECT * FROM collaboration_sessions WHERE id = ? AND active = 1', 
-        (session_id,)
-    ).fetchone()
-    conn.close()
-    return dict(session) if session else None
+    with connection() as conn:
+        session = conn.execute(
+            'SELECT * FROM collaboration_sessions_with_code WHERE id = ? AND active = 1', 
+            (session_id,)
+        ).fetchone()
+    return code_row(session)
 
+@timed_helper
 def update_collaboration_code(session_id, code, language):
-    conn = get_db()
-    conn.execute('''
-        UPDATE collaboration_sessions 
-        SET code = ?, language = ? 
-        WHERE id = ? AND active = 1
-    ''', (code, language, session_id))
-    conn.commit()
-    conn.close()
+    update_collaboration_codes([(session_id, code, language)])
+
+@timed_helper
+def update_collaboration_codes(updates):
+    # Batched form of update_collaboration_code: updates is an iterable of (session_id, code, language)
+    updates = list(updates)
+    if not updates:
+        return
+    with transaction() as conn:
+        placeholders = ', '.join('?' * len(updates))
+        replaced = [row['code_hash'] for row in conn.execute(
+            f'SELECT code_hash FROM collaboration_sessions WHERE id IN ({placeholders})',
+            [session_id for session_id, _, _ in updates]
+        )]
+        conn.executemany('''
+            UPDATE collaboration_sessions 
+            SET code_hash = ?, language = ? 
+            WHERE id = ? AND active = 1
+        ''', [(store_code(conn, code), language, session_id) for session_id, code, language in updates])
+        # Live sessions produce a new blob per flush; drop the superseded ones right away
+        collect_code_blobs(replaced)
 
+@timed_helper
 def save_collaboration_message(session_id, sender, message):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO collaboration_messages (session_id, sender, message, timestamp)
-        VALUES (?, ?, ?, ?)
-    ''', (session_id, sender, message, datetime.now().isoformat()))
-    conn.commit()
-    message_id = c.lastrowid
-    conn.close()
-    return message_id
+    with connection() as conn:
+        c = conn.execute('''
+            INSERT INTO collaboration_messages (session_id, sender, message, timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', (session_id, sender, message, datetime.now().isoformat()))
+        return c.lastrowid
 
+@timed_helper
 def get_collaboration_messages(session_id, limit=50):
-    conn = get_db()
-    messages = conn.execute('''
-        SELECT * FROM collaboration_messages 
-        WHERE session_id = ? 
-        ORDER BY timestamp DESC 
-        LIMIT ?
-    ''', (session_id, limit)).fetchall()
-    conn.close()
+    with connection() as conn:
+        messages = conn.execute('''
+            SELECT * FROM collaboration_messages 
+            WHERE session_id = ? 
+            ORDER BY timestamp DESC 
+            LIMIT ?
+        ''', (session_id, limit)).fetchall()
     return [dict(msg) for msg in messages][::-1]  # Reverse to get chronological order
 
+@timed_helper
 def end_collaboration_session(session_id):
-    conn = get_db()
-    conn.execute('''
-        UPDATE collaboration_sessions 
-        SET active = 0 
-        WHERE id = ?
-    ''', (session_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute('''
+            UPDATE collaboration_sessions 
+            SET active = 0, ended_at = COALESCE(ended_at, ?)
+            WHERE id = ?
+        ''', (datetime.now().isoformat(), session_id))
+
+# Generation cache functions
+@timed_helper
+def get_cached_generation(cache_key, now):
+    with connection() as conn:
+        entry = conn.execute(
+            'SELECT * FROM generation_cache WHERE cache_key = ? AND expires_at > ?',
+            (cache_key, now)
+        ).fetchone()
+        if entry:
+            conn.execute(
+                'UPDATE generation_cache SET last_accessed = ? WHERE cache_key = ?',
+                (now, cache_key)
+            )
+    return dict(entry) if entry else None
+
+@timed_helper
+def save_cached_generation(cache_key, code, explanation, future_steps, now, expires_at, max_entries):
+    with transaction() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO generation_cache
+            (cache_key, code, explanation, future_steps, created_at, last_accessed, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (cache_key, code, explanation, future_steps, now, now, expires_at))
+        # Evict expired entries, then the least recently used ones beyond the size limit
+        conn.execute('DELETE FROM generation_cache WHERE expires_at <= ?', (now,))
+        conn.execute('''
+            DELETE FROM generation_cache WHERE cache_key IN (
+                SELECT cache_key FROM generation_cache
+                ORDER BY last_accessed DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (max_entries,))
+
+@timed_helper
+def count_cached_generations():
+    with connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM generation_cache').fetchone()[0]
+
+# Maintenance functions: each returns the number of rows (or pages) it reclaimed.
+# Deletes run in batches so a large backlog never holds the write lock for long.
+def _delete_in_batches(table, where, params, batch_size):
+    deleted = 0
+    while True:
+        with transaction() as conn:
+            count = conn.execute(f'''
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM {table} WHERE {where} LIMIT ?
+                )
+            ''', (*params, batch_size)).rowcount
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+@timed_helper
+def delete_expired_shares(now, batch_size=500):
+    return _delete_in_batches('shared_code', 'expires_at <= ?', (now,), batch_size)
+
+@timed_helper
+def delete_unused_code_renders(batch_size=500):
+    # Renders are keyed by content, so they stay as long as any share still has that code
+    return _delete_in_batches(
+        'shared_code_renders',
+        'NOT EXISTS (SELECT 1 FROM shared_code WHERE code_hash = shared_code_renders.content_hash)',
+        (), batch_size
+    )
+
+@timed_helper
+def delete_ended_collaboration_sessions(before, batch_size=500):
+    # Sessions that ended before `before`, together with their messages. Returns (sessions, messages).
+    stale = 'active = 0 AND ended_at < ?'
+    messages = _delete_in_batches(
+        'collaboration_messages',
+        f'session_id IN (SELECT id FROM collaboration_sessions WHERE {stale})',
+        (before,), batch_size
+    )
+    sessions = _delete_in_batches('collaboration_sessions', stale, (before,), batch_size)
+    return sessions, messages
+
+@timed_helper
+def delete_collaboration_messages(before, batch_size=500):
+    return _delete_in_batches('collaboration_messages', 'timestamp < ?', (before,), batch_size)
+
+@timed_helper
+def optimize_database(vacuum_pages=1000):
+    # Refreshes query planner statistics and returns up to `vacuum_pages` free pages to the filesystem
+    with connection() as conn:
+        conn.execute('PRAGMA optimize')
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if before and vacuum_pages:
+            # executescript steps the pragma to completion; execute() would free a single page
+            conn.executescript(f'PRAGMA incremental_vacuum({int(vacuum_pages)})')
+        return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
@@ -0,0 +1,81 @@
+import functools
+import hashlib
+import logging
+import threading
+
+from pygments.util import ClassNotFound
+
+from cache import LRUCache
+from database import get_shared_code_render, save_shared_code_render
+
+logger = logging.getLogger(__name__)
+
+# Lexers, formatters and the style plugin scan are imported on first render rather than at startup
+
+@functools.lru_cache(maxsize=None)
+def themes():
+    from pygments.styles import get_all_styles
+    return frozenset(get_all_styles())
+
+def content_hash(code):
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def highlight_css(theme):
+    from pygments.formatters import HtmlFormatter
+    return HtmlFormatter(style=theme, cssclass='highlight').get_style_defs('.highlight')
+
+def render_code(code, language, theme):
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.lexers.special import TextLexer
+    try:
+        lexer = get_lexer_by_name(language or 'text')
+    except ClassNotFound:
+        lexer = TextLexer()
+    formatter = HtmlFormatter(style=theme, cssclass='highlight', linenos='table')
+    return highlight(code, lexer, formatter)
+
+class HighlightCache:
+    # Rendered HTML keyed by (code hash, language, theme): an in-process LRU in front of the
+    # shared_code_renders table, so shares of identical code render once
+    def __init__(self, max_entries=256, persistent=True):
+        self.persistent = persistent
+        self.memory = LRUCache(max_entries=max_entries)
+        self.stats = {'memory_hits': 0, 'persistent_hits': 0, 'renders': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def render(self, code, language, theme, code_hash=None):
+        code_hash = code_hash or content_hash(code)
+        key = (code_hash, language, theme)
+        html = self.memory.get(key)
+        if html is not None:
+            self._count('memory_hits')
+            return html
+
+        if self.persistent:
+            try:
+                html = get_shared_code_render(code_hash, language, theme)
+            except Exception as e:
+                logger.error(f"Error reading rendered code: {str(e)}")
+                self._count('errors')
+            if html is not None:
+                self.memory.set(key, html)
+                self._count('persistent_hits')
+                return html
+
+        html = render_code(code, language, theme)
+        self._count('renders')
+        self.memory.set(key, html)
+        if self.persistent:
+            try:
+                save_shared_code_render(code_hash, language, theme, html)
+            except Exception as e:
+                logger.error(f"Error saving rendered code: {str(e)}")
+                self._count('errors')
+        return html
@@ -0,0 +1,250 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    pass
+
+class UserLimitReached(QueueFull):
+    pass
+
+def new_job(owner, payload):
+    return {
+        'id': uuid.uuid4().hex,
+        'owner': owner,
+        'status': 'queued',
+        'payload': payload,
+        'result': None,
+        'error': None,
+        'created_at': datetime.now().isoformat(),
+        'started_at': None,
+        'finished_at': None
+    }
+
+class JobQueue:
+    # Shared job lifecycle: queued -> running -> completed | failed.
+    #   handler(payload)  - does the work and returns a JSON-serialisable result
+    #   on_complete(job)  - called from the worker once a job has finished either way
+    def __init__(self, handler, max_depth=100, per_user_limit=2, result_ttl=3600, on_complete=None):
+        self.handler = handler
+        self.max_depth = max_depth
+        self.per_user_limit = per_user_limit
+        self.result_ttl = result_ttl
+        self.on_complete = on_complete
+
+    def _execute(self, job):
+        job['status'] = 'running'
+        job['started_at'] = datetime.now().isoformat()
+        self._save(job)
+        try:
+            job['result'] = self.handler(job['payload'])
+            job['status'] = 'completed'
+        except Exception as e:
+            logger.error(f"Error running job {job['id']}: {str(e)}")
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        job['finished_at'] = datetime.now().isoformat()
+        self._save(job)
+
+    def _notify(self, job):
+        if self.on_complete is None:
+            return
+        try:
+            self.on_complete(job)
+        except Exception as e:
+            logger.error(f"Error in completion callback for job {job['id']}: {str(e)}")
+
+    def _save(self, job):
+        pass
+
+class LocalJobQueue(JobQueue):
+    # In-process queue on a bounded thread pool; jobs are lost if the process exits
+    def __init__(self, handler, workers=4, **kwargs):
+        super().__init__(handler, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='generation-job')
+        self._jobs = {}
+        self._active = {}
+        self._queued = 0
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner, payload):
+        job = new_job(owner, payload)
+        with self._lock:
+            self._prune()
+            if self._queued >= self.max_depth:
+                raise QueueFull(f"Generation queue is full ({self.max_depth} jobs waiting)")
+            if self._active.get(owner, 0) >= self.per_user_limit:
+                raise UserLimitReached(f"At most {self.per_user_limit} generations can be in progress at once")
+            self._queued += 1
+            self._active[owner] = self._active.get(owner, 0) + 1
+            self._jobs[job['id']] = job
+        self.executor.submit(self._run, job)
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self):
+        with self._lock:
+            running = sum(self._active.values()) - self._queued
+            return {'queued': self._queued, 'running': running, 'jobs': len(self._jobs)}
+
+    def shutdown(self, timeout=0):
+        # Stops taking jobs, then waits up to `timeout` seconds for accepted ones to finish
+        self.executor.shutdown(wait=False)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._active:
+                    return
+            time.sleep(0.1)
+
+    def _run(self, job):
+        with self._lock:
+            self._queued -= 1
+        try:
+            self._execute(job)
+        finally:
+            with self._lock:
+                remaining = self._active.get(job['owner'], 1) - 1
+                if remaining:
+                    self._active[job['owner']] = remaining
+                else:
+                    self._active.pop(job['owner'], None)
+                self._finished[job['id']] = time.monotonic()
+        self._notify(dict(job))
+
+    def _save(self, job):
+        with self._lock:
+            self._jobs[job['id']] = job
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.result_ttl
+        for job_id in [job_id for job_id, finished in self._finished.items() if finished < cutoff]:
+            del self._finished[job_id]
+            self._jobs.pop(job_id, None)
+
+# Redis layout:
+#   {prefix}:queue          - list of queued job ids, consumed with BLPOP by every process's workers
+#   {prefix}:job:{id}       - job JSON, expires result_ttl after its last update
+#   {prefix}:active:{owner} - queued + running jobs for an owner; expires so a crashed worker can't pin it
+
+SUBMIT_SCRIPT = '''
+if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 1
+end
+if tonumber(redis.call('GET', KEYS[3]) or '0') >= tonumber(ARGV[4]) then
+    return 2
+end
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[5])
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+redis.call('RPUSH', KEYS[1], ARGV[2])
+return 0
+'''
+
+def parse_queued(item):
+    # Queue entries are [job id, owner] so a worker can free the owner's slot even after the job
+    # itself has expired. Entries queued before that were bare ids and carry no owner.
+    try:
+        job_id, owner = json.loads(item)
+        return job_id, owner
+    except (ValueError, TypeError):
+        return item, None
+
+RELEASE_SCRIPT = '''
+if redis.call('DECR', KEYS[1]) <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+class RedisJobQueue(JobQueue):
+    # Queue shared by every web process; each process runs `workers` consumer threads
+    def __init__(self, client, handler, workers=4, prefix='generation', **kwargs):
+        super().__init__(handler, **kwargs)
+        self.client = client
+        self.workers = workers
+        self.prefix = prefix
+        self.queue_key = f"{prefix}:queue"
+        self._submit = client.register_script(SUBMIT_SCRIPT)
+        self._release = client.register_script(RELEASE_SCRIPT)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _job_key(self, job_id):
+        return f"{self.prefix}:job:{job_id}"
+
+    def _active_key(self, owner):
+        return f"{self.prefix}:active:{owner}"
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"generation-job-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, owner, payload):
+        job = new_job(owner, payload)
+        rejected = self._submit(
+            keys=[self.queue_key, self._job_key(job['id']), self._active_key(owner)],
+            args=[json.dumps(job), json.dumps([job['id'], owner]), self.max_depth, self.per_user_limit, self.result_ttl]
+        )
+        if rejected == 1:
+            raise QueueFull(f"Generation queue is full ({self.max_depth} jobs waiting)")
+        if rejected == 2:
+            raise UserLimitReached(f"At most {self.per_user_limit} generations can be in progress at once")
+        return job
+
+    def get(self, job_id):
+        raw = self.client.get(self._job_key(job_id))
+        return json.loads(raw) if raw else None
+
+    def stats(self):
+        return {'queued': self.client.llen(self.queue_key), 'workers': len(self._threads)}
+
+    def shutdown(self, timeout=2):
+        # Queued jobs stay in Redis for the other processes; running ones get `timeout` seconds
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+        self._threads = []
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                item = self.client.blpop(self.queue_key, timeout=1)
+            except Exception as e:
+                logger.error(f"Error polling generation queue: {str(e)}")
+                self._stop.wait(1)
+                continue
+            if item is None:
+                continue
+            job_id, owner = parse_queued(item[1])
+            job = self.get(job_id)
+            if job is None:
+                logger.warning(f"Skipping job {job_id}: it expired before a worker picked it up")
+                if owner is not None:
+                    self._release(keys=[self._active_key(owner)])
+                continue
+            try:
+                self._execute(job)
+            finally:
+                self._release(keys=[self._active_key(job['owner'])])
+            self._notify(job)
+
+    def _save(self, job):
+        self.client.set(self._job_key(job['id']), json.dumps(job), ex=self.result_ttl)
@@ -0,0 +1,155 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+
+# Logging that stays off the request path. Records are level-gated where they are created, stamped
+# with the current correlation ids and put on a bounded queue; a listener thread formats and writes
+# them, so slow log I/O never holds up a request. A full queue drops records (counted) instead of
+# blocking. Large payloads go through payload(), which renders lazily and truncates.
+
+request_id = contextvars.ContextVar('request_id', default='-')
+room = contextvars.ContextVar('room', default='-')
+CORRELATION_IDS = {'request_id': request_id, 'room': room}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(request_id)s %(room)s] %(message)s'
+
+settings = {'payload_limit': 2000, 'string_limit': 200, 'list_limit': 20, 'sample_rate': 1.0}
+listener = None
+handler = None
+
+def new_id():
+    return uuid.uuid4().hex[:16]
+
+def set_ids(**ids):
+    # Ids not given keep their value; None resets one, so a reused thread doesn't inherit stale ids
+    for name, value in ids.items():
+        CORRELATION_IDS[name].set(str(value) if value is not None else '-')
+
+def carry(func):
+    # Runs func with the caller's correlation ids, for work handed to another thread
+    return functools.partial(contextvars.copy_context().run, func)
+
+def truncate(text, limit=None):
+    limit = settings['payload_limit'] if limit is None else limit
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... (+{len(text) - limit} chars)"
+
+def shorten(value):
+    # Bounds every string and list inside a payload before it is serialised, so logging a request
+    # costs the same whether it carries ten lines of code or ten thousand
+    if isinstance(value, str):
+        return truncate(value, settings['string_limit'])
+    if isinstance(value, dict):
+        return {key: shorten(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [shorten(item) for item in value[:settings['list_limit']]]
+        if len(value) > settings['list_limit']:
+            items.append(f"... (+{len(value) - settings['list_limit']} items)")
+        return items
+    return value
+
+class Payload:
+    # Rendered only when a handler formats the record, so disabled levels never serialise it
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        if isinstance(self.value, str):
+            return truncate(self.value)
+        return truncate(json.dumps(shorten(self.value), default=str, separators=(',', ':')))
+
+def payload(value):
+    return Payload(value)
+
+def log_payload(logger, message, value, level=logging.DEBUG):
+    # Full request/response bodies: level-gated first, then sampled by LOG_PAYLOAD_SAMPLE_RATE
+    if not logger.isEnabledFor(level):
+        return
+    rate = settings['sample_rate']
+    if rate < 1 and random.random() >= rate:
+        return
+    logger.log(level, '%s: %s', message, Payload(value))
+
+class CorrelationFilter(logging.Filter):
+    # Runs in the thread that logged, where the context variables are set
+    def filter(self, record):
+        for name, var in CORRELATION_IDS.items():
+            setattr(record, name, var.get())
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        for name in CORRELATION_IDS:
+            entry[name] = getattr(record, name, '-')
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+class QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room instead of failing when shutdown finds the queue full
+        self.queue.put(self._sentinel)
+
+def dropped():
+    return handler.dropped if handler is not None else 0
+
+def setup(level='INFO', fmt='text', queue_size=10000, payload_limit=2000, string_limit=200, sample_rate=1.0):
+    # Replaces the root handlers with the queue handler and starts the listener; safe to call again
+    global listener, handler
+    stop()
+    settings.update(payload_limit=payload_limit, string_limit=string_limit, sample_rate=sample_rate)
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, stream)
+    listener.start()
+
+def stop():
+    # Writes out whatever is still queued
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+atexit.register(stop)
@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import (
+    collect_code_blobs, delete_collaboration_messages, delete_ended_collaboration_sessions,
+    delete_expired_shares, delete_unused_code_renders, optimize_database
+)
+
+logger = logging.getLogger(__name__)
+
+class MaintenanceSweeper:
+    # Background retention pass over the database. Each sweep:
+    #   - deletes expired shares, then renders no remaining share uses
+    #   - deletes sessions ended more than session_retention seconds ago, with their messages
+    #   - deletes messages older than message_retention seconds
+    #   - collects code blobs nothing references any more
+    #   - runs PRAGMA optimize and frees up to vacuum_pages pages through incremental vacuum
+    # A retention of 0 keeps those rows forever. The first sweep waits `delay` seconds so it
+    # doesn't compete with startup.
+    def __init__(self, interval=3600, session_retention=7 * 86400, message_retention=30 * 86400,
+                 vacuum_pages=1000, batch_size=500, delay=0):
+        self.interval = interval
+        self.delay = delay
+        self.session_retention = session_retention
+        self.message_retention = message_retention
+        self.vacuum_pages = vacuum_pages
+        self.batch_size = batch_size
+        self.stats = {'runs': 0, 'errors': 0, 'reclaimed': {}, 'last_run': None}
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='maintenance-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self._thread = None
+
+    def cutoff(self, seconds):
+        return (datetime.now() - timedelta(seconds=seconds)).isoformat()
+
+    def sweep(self):
+        with self._run_lock:
+            started = time.monotonic()
+            report = {'shares': 0, 'renders': 0, 'sessions': 0, 'messages': 0, 'blobs': 0, 'pages': 0}
+            report['shares'] = delete_expired_shares(datetime.now().isoformat(), self.batch_size)
+            report['renders'] = delete_unused_code_renders(self.batch_size)
+            if self.session_retention > 0:
+                report['sessions'], report['messages'] = delete_ended_collaboration_sessions(
+                    self.cutoff(self.session_retention), self.batch_size)
+            if self.message_retention > 0:
+                report['messages'] += delete_collaboration_messages(
+                    self.cutoff(self.message_retention), self.batch_size)
+            report['blobs'] = collect_code_blobs()
+            report['pages'] = optimize_database(self.vacuum_pages)
+            report['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+            self.stats['runs'] += 1
+            self.stats['last_run'] = dict(report, finished_at=datetime.now().isoformat())
+            for name, count in report.items():
+                if name != 'duration_ms':
+                    self.stats['reclaimed'][name] = self.stats['reclaimed'].get(name, 0) + count
+        logger.info(
+            f"Maintenance reclaimed {report['shares']} shares, {report['renders']} renders, "
+            f"{report['sessions']} sessions, {report['messages']} messages, {report['blobs']} code blobs "
+            f"and {report['pages']} pages in {report['duration_ms']}ms"
+        )
+        return report
+
+    def _run(self):
+        # The first sweep comes `delay` seconds after start rather than a whole interval, so processes
+        # restarted more often than every interval still clean up
+        if self._stop.wait(self.delay):
+            return
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error running database maintenance: {str(e)}")
+                self.stats['errors'] += 1
+            if self._stop.wait(self.interval):
+                return
@@ -0,0 +1,218 @@
+import bisect
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus-style metrics. Counters and histograms keep one shard per thread, so the hot
+# path is a thread-local dict update with no lock; shards are only merged when /metrics is scraped.
+# Shards of finished threads are folded into a retired total so per-request threads don't pile up.
+# Under eventlet or gevent every request is a greenlet, so shards follow OS threads instead.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def native_thread_ident():
+    # With the standard library monkey patched, threading.local and current_thread() are per
+    # greenlet, and a finished greenlet still reports alive. Returns the unpatched thread id
+    # function in that case, None when threads are real.
+    patcher = sys.modules.get('eventlet.patcher')
+    if patcher is not None and patcher.is_monkey_patched('thread'):
+        return patcher.original('_thread').get_ident
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is not None and monkey.is_module_patched('threading'):
+        return monkey.get_original('_thread', 'get_ident')
+    return None
+
+class ShardedMetric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        # Greenlets on one OS thread only switch on I/O, so they can share its shard safely
+        self._native_ident = native_thread_ident()
+        self._native_shards = {}
+
+    def _shard(self):
+        if self._native_ident is not None:
+            ident = self._native_ident()
+            shard = self._native_shards.get(ident)
+            if shard is None:
+                with self._lock:
+                    shard = self._native_shards[ident] = {}
+                    # The hub and blocking-call threads live as long as the process, never retired
+                    self._shards.append((None, shard))
+            return shard
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _collect(self):
+        # Copies are taken under the GIL, so a concurrent increment lands either before or after
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread is None or thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, dict(shard))
+            self._shards = live
+            totals = {}
+            self._merge(totals, self._retired)
+            for _, shard in live:
+                self._merge(totals, dict(shard))
+        return totals
+
+    def _merge(self, into, shard):
+        raise NotImplementedError
+
+class Counter(ShardedMetric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, into, shard):
+        for labels, value in shard.items():
+            into[labels] = into.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in sorted(self._collect().items()):
+            yield self.name, format_labels(self.labels, labels), value
+
+class Histogram(ShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # Per-bucket counts (not cumulative) followed by the sum and the count
+            entry = shard[labels] = [0] * (len(self.buckets) + 3)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def timed(self, *labels):
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(*labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def _merge(self, into, shard):
+        for labels, entry in shard.items():
+            total = into.get(labels)
+            if total is None:
+                into[labels] = list(entry)
+            else:
+                for index, value in enumerate(entry):
+                    total[index] += value
+
+    def samples(self):
+        for labels, entry in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry):
+                cumulative += count
+                yield f'{self.name}_bucket', format_labels(self.labels, labels, [('le', format_value(float(bound)))]), cumulative
+            yield f'{self.name}_sum', format_labels(self.labels, labels), entry[-2]
+            yield f'{self.name}_count', format_labels(self.labels, labels), entry[-1]
+
+class CallbackMetric:
+    # Values read from existing state at scrape time: callback() returns {label values tuple: value}
+    def __init__(self, name, documentation, callback, labels=(), kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self):
+        for labels, value in sorted(self.callback().items()):
+            yield self.name, format_labels(self.labels, labels), value
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def counter(name, documentation, labels=()):
+    return registry.register(Counter(name, documentation, labels))
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, documentation, labels, buckets))
+
+def callback(name, documentation, func, labels=(), kind='gauge'):
+    return registry.register(CallbackMetric(name, documentation, func, labels, kind))
+
+def render():
+    return registry.render()
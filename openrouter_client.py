@@ -0,0 +1,207 @@
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class OpenRouterError(Exception):
+    pass
+
+class CircuitOpenError(OpenRouterError):
+    pass
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures and lets a single trial call through after `reset_timeout`.
+    # allow() returns 'trial' for that call.
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+            return 'trial'
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+
+    def release(self):
+        # For a trial call that ended without an outcome (interrupted, or killed with its greenlet),
+        # so the next call can be the trial instead
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_progress = False
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error(f"OpenRouter circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class OpenRouterClient:
+    def __init__(self, api_url, api_key, pool_size=10, connect_timeout=5, read_timeout=60,
+                 max_retries=3, backoff_base=0.5, backoff_max=8, retry_after_max=30,
+                 breaker_threshold=5, breaker_reset_timeout=30):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+        self.stats = {'requests': 0, 'retries': 0, 'errors': 0, 'failures': 0, 'rejected': 0}
+        self._stats_lock = threading.Lock()
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created on the first call so importing the app doesn't pay for it.
+        # Keep-alive connections are reused across calls instead of a TCP+TLS handshake per completion.
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers.update({
+                        "Authorization": f"Bearer {self.api_key}",
+                        "HTTP-Referer": "http://localhost:5005",
+                        "X-Title": "Code Generation IDE",
+                        "Content-Type": "application/json"
+                    })
+                    self._session = session
+        return self._session
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                if retry_after > self.retry_after_max:
+                    return None
+                delay = max(delay, retry_after)
+        return delay
+
+    def _attempt_timeout(self, timeout, deadline):
+        timeout = timeout or self.timeout
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        if deadline is None:
+            return connect_timeout, read_timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout("deadline passed before the request was sent")
+        return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+    def chat_completion(self, data, stream=False, timeout=None, deadline=None):
+        # Returns the final response; non-retryable errors are left for the caller to inspect.
+        # deadline is a time.monotonic() value: each attempt's timeouts are capped by the time left
+        # and no retry starts past it, so retries and backoff can't outlast a caller that stopped waiting.
+        allowed = self.breaker.allow()
+        if not allowed:
+            self._count('rejected')
+            raise CircuitOpenError("OpenRouter API Error: upstream unavailable, circuit breaker is open")
+
+        try:
+            return self._post(data, stream, timeout, deadline)
+        except BaseException:
+            if allowed == 'trial':
+                self.breaker.release()
+            raise
+
+    def _post(self, data, stream, timeout, deadline):
+        attempt = 0
+        while True:
+            self._count('requests')
+            response = None
+            try:
+                response = self.session.post(
+                    self.api_url, json=data, stream=stream, timeout=self._attempt_timeout(timeout, deadline))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.RequestException as e:
+                # An invalid URL or request won't get better by retrying
+                self._count('failures')
+                self.breaker.record_failure()
+                raise OpenRouterError(f"OpenRouter API Error: {str(e)}") from e
+            else:
+                if not response.ok:
+                    self._count('errors')
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                error = None
+
+            delay = self._backoff(attempt, response) if attempt < self.max_retries else None
+            if delay is not None and deadline is not None and time.monotonic() + delay >= deadline:
+                delay = None
+            if delay is None:
+                self._count('failures')
+                self.breaker.record_failure()
+                if response is not None:
+                    return response
+                raise OpenRouterError(f"OpenRouter API Error: {str(error)}") from error
+
+            reason = f"status {response.status_code}" if response is not None else str(error)
+            logger.warning(f"Retrying OpenRouter call in {delay:.2f}s after {reason} (attempt {attempt + 1}/{self.max_retries})")
+            if response is not None:
+                response.close()
+            self._count('retries')
+            time.sleep(delay)
+            attempt += 1
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['circuit'] = self.breaker.state
+        return stats
@@ -0,0 +1,224 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class LocalPresenceStore:
+    # Single-process presence: participants per room with an expiry that heartbeats push forward
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def join(self, room, participant):
+        self.refresh([(room, participant)])
+        return self.participants(room)
+
+    def refresh(self, members):
+        expires = time.time() + self.ttl
+        with self._lock:
+            for room, participant in members:
+                self._rooms.setdefault(room, {})[participant] = expires
+
+    def leave(self, room, participant):
+        with self._lock:
+            self._rooms.get(room, {}).pop(participant, None)
+        return self.participants(room)
+
+    def participants(self, room):
+        now = time.time()
+        with self._lock:
+            members = self._rooms.get(room)
+            if members is None:
+                return []
+            for participant in [p for p, expires in members.items() if expires <= now]:
+                del members[participant]
+            if not members:
+                del self._rooms[room]
+            return sorted(members)
+
+    def clear(self, room):
+        with self._lock:
+            self._rooms.pop(room, None)
+
+class RedisPresenceStore:
+    # Shared presence: one sorted set per room scored by expiry time. Participants whose worker
+    # stops heartbeating (crash, network split) fall out after `ttl` seconds.
+    def __init__(self, client, ttl=60, prefix='collab'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, room):
+        return f"{self.prefix}:presence:{room}"
+
+    def join(self, room, participant):
+        self.refresh([(room, participant)])
+        return self.participants(room)
+
+    def refresh(self, members):
+        if not members:
+            return
+        expires = time.time() + self.ttl
+        pipe = self.client.pipeline(transaction=False)
+        for room, participant in members:
+            key = self._key(room)
+            pipe.zadd(key, {participant: expires})
+            pipe.expire(key, int(self.ttl * 2))
+        pipe.execute()
+
+    def leave(self, room, participant):
+        self.client.zrem(self._key(room), participant)
+        return self.participants(room)
+
+    def participants(self, room):
+        key = self._key(room)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zremrangebyscore(key, '-inf', time.time())
+        pipe.zrange(key, 0, -1)
+        return sorted(pipe.execute()[1])
+
+    def clear(self, room):
+        self.client.delete(self._key(room))
+
+class PresenceTracker:
+    # Socket connections owned by this worker. Their presence entries are re-announced every
+    # `interval` seconds, so the store only has to expire entries nobody is refreshing.
+    def __init__(self, store, interval=20):
+        self.store = store
+        self.interval = interval
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='presence-heartbeat', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.interval)
+        self._thread = None
+
+    def join(self, sid, room, participant):
+        with self._lock:
+            self._connections[sid] = (room, participant)
+        if self._thread is None:
+            self.start()
+        return self.store.join(room, participant)
+
+    def leave(self, sid):
+        # Returns (room, participant, remaining participants), or None if the connection wasn't in a room
+        with self._lock:
+            member = self._connections.pop(sid, None)
+            # Another tab of the same participant on this worker keeps them present
+            still_connected = member in self._connections.values()
+        if member is None:
+            return None
+        room, participant = member
+        if still_connected:
+            return room, participant, self.store.participants(room)
+        return room, participant, self.store.leave(room, participant)
+
+    def participants(self, room):
+        return self.store.participants(room)
+
+    def stats(self):
+        # Rooms and participants with a socket on this worker
+        with self._lock:
+            members = set(self._connections.values())
+            connections = len(self._connections)
+        return {
+            'connections': connections,
+            'rooms': len({room for room, _ in members}),
+            'participants': len(members)
+        }
+
+    def clear(self, room):
+        with self._lock:
+            for sid in [sid for sid, member in self._connections.items() if member[0] == room]:
+                del self._connections[sid]
+        self.store.clear(room)
+
+    def heartbeat(self):
+        with self._lock:
+            members = set(self._connections.values())
+        self.store.refresh(members)
+        return len(members)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Error refreshing collaboration presence: {str(e)}")
+
+class EventAggregator:
+    # Coalesces ephemeral room events (typing, cursors, ...) and publishes at most one batch per room
+    # every `window` seconds. Only the latest state per participant survives a window, so message
+    # volume follows the number of active rooms rather than the number of keystrokes.
+    #   publish(batches) receives {room: {'participants': {participant: state}, **room_fields}}
+    def __init__(self, publish, window=0.1, name='event-aggregator'):
+        self.publish = publish
+        self.window = window
+        self.name = name
+        self.stats = {'events': 0, 'batches': 0, 'errors': 0}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.window * 10)
+        self._thread = None
+        self.flush()
+
+    def update(self, room, participant=None, **fields):
+        # Participant fields merge into that participant's state; without a participant they are room-wide
+        with self._lock:
+            batch = self._pending.setdefault(room, {'participants': {}})
+            if participant is None:
+                batch.update(fields)
+            else:
+                batch['participants'].setdefault(participant, {}).update(fields)
+            self.stats['events'] += 1
+        if self._thread is None:
+            self.start()
+
+    def flush(self):
+        with self._lock:
+            batches = self._pending
+            self._pending = {}
+        if not batches:
+            return 0
+        try:
+            self.publish(batches)
+        except Exception as e:
+            logger.error(f"Error publishing {len(batches)} batched room events ({self.name}): {str(e)}")
+            self.stats['errors'] += 1
+            return 0
+        self.stats['batches'] += len(batches)
+        return len(batches)
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            self.flush()
@@ -0,0 +1,238 @@
+import argparse
+import os
+import signal
+import sys
+import time
+
+# Production entry point: serves the app on eventlet or gevent instead of the Werkzeug
+# development server that `python app.py` starts.
+#
+#   python server.py --bind 0.0.0.0:5008 --async-mode eventlet --connections 2000
+#
+# Every connection is a greenlet. OpenRouter, Redis and Pusher calls yield to other greenlets once
+# the standard library is monkey patched, and SQLite calls run on --blocking-threads OS threads,
+# so slow generations and thousands of idle sockets don't hold each other up.
+#
+# --workers N starts N processes on consecutive ports, for a load balancer with sticky sessions
+# (Socket.IO polling must keep reaching the same process). They reach each other's sockets
+# through SOCKETIO_MESSAGE_QUEUE, which is then required; set GENERATION_QUEUE_URL and
+# COLLAB_REDIS_URL as well so jobs and rooms are shared.
+#
+# SIGTERM or SIGINT stops accepting connections and disconnects sockets. Requests in flight get
+# --graceful-timeout seconds to finish, then generation jobs, buffered edits and batched events
+# are flushed.
+
+ASYNC_MODES = ('eventlet', 'gevent')
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+class RequestGate:
+    # WSGI wrapper that counts requests in flight (streams until their body is closed). Once
+    # draining, new requests get a 503 so load balancers move traffic elsewhere. eventlet's own
+    # shutdown can't be used for this: it closes connections whether or not a request is running.
+    def __init__(self, wsgi_app):
+        from werkzeug.wsgi import ClosingIterator
+
+        self.wsgi_app = wsgi_app
+        self.closing = ClosingIterator
+        self.active = 0
+        self.draining = False
+
+    def __call__(self, environ, start_response):
+        if self.draining:
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'text/plain'), ('Connection', 'close'), ('Retry-After', '1')
+            ])
+            return [b'Server is shutting down\n']
+        self.active += 1
+        try:
+            return self.closing(self.wsgi_app(environ, start_response), self._finished)
+        except BaseException:
+            self.active -= 1
+            raise
+
+    def _finished(self):
+        self.active -= 1
+
+def patch(async_mode, blocking_threads):
+    # Runs before anything imports socket, threading or requests. Returns run_blocking(func, *args)
+    # for database.py, which runs func on a real OS thread.
+    if async_mode == 'eventlet':
+        os.environ['EVENTLET_THREADPOOL_SIZE'] = str(blocking_threads)
+        import eventlet
+        eventlet.monkey_patch()
+        from eventlet import tpool
+        return tpool.execute
+
+    from gevent import monkey
+    monkey.patch_all()
+    import gevent
+    threadpool = gevent.get_hub().threadpool
+    threadpool.maxsize = blocking_threads
+    return lambda func, *args, **kwargs: threadpool.apply(func, args, kwargs)
+
+def serve(args):
+    run_blocking = patch(args.async_mode, args.blocking_threads)
+    os.environ['SOCKETIO_ASYNC_MODE'] = args.async_mode
+
+    import database
+    database.run_blocking = run_blocking
+
+    import logging
+    import app
+    import logs
+
+    app.startup()
+    logger = logging.getLogger('server')
+    host, port = parse_bind(args.bind)
+    gate = app.app.wsgi_app = RequestGate(app.app.wsgi_app)
+    main = None
+    stopping = []
+
+    def watchdog():
+        # Requests and generation jobs each get graceful_timeout; past both, exit regardless
+        app.socketio.sleep(args.graceful_timeout * 2 + 5)
+        logger.warning('Shutdown is taking too long, exiting without waiting further')
+        logs.stop()
+        os._exit(1)
+
+    def drain():
+        # Disconnecting every socket ends the long-lived websocket and polling requests, so only
+        # ordinary requests and streams are left to finish
+        started = time.monotonic()
+        gate.draining = True
+        # eio.disconnect() waits for each socket's close packet to be sent, which never happens for a
+        # polling client that stopped polling; such sockets are closed without waiting
+        eio = app.socketio.server.eio
+        for client in list(eio.sockets.values()):
+            client.close(wait=False)
+        eio.sockets = {}
+        while gate.active and time.monotonic() - started < args.graceful_timeout:
+            app.socketio.sleep(0.1)
+        if gate.active:
+            logger.warning(f"Closing {gate.active} requests still running after {args.graceful_timeout}s")
+        if args.async_mode == 'eventlet':
+            import eventlet
+            eventlet.kill(main, SystemExit)
+        else:
+            app.socketio.wsgi_server.stop(timeout=1)
+
+    def request_shutdown(signum, frame=None):
+        # Only records the signal. Under eventlet the handler runs while the hub sits in epoll,
+        # which Python resumes afterwards, so anything spawned here could wait for the next timer.
+        if not stopping:
+            stopping.append(signum)
+
+    def wait_for_signal():
+        while not stopping:
+            app.socketio.sleep(0.5)
+        logger.info(f"Received {signal.Signals(stopping[0]).name}, draining connections")
+        app.socketio.start_background_task(watchdog)
+        drain()
+
+    options = {'log_output': args.access_log}
+    if args.async_mode == 'eventlet':
+        import eventlet
+        main = eventlet.getcurrent()
+        options.update(max_size=args.connections, log=logging.getLogger('eventlet.wsgi'))
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, request_shutdown)
+    else:
+        import gevent
+        import gevent.pool
+        options['spawn'] = gevent.pool.Pool(args.connections)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            gevent.signal_handler(signum, request_shutdown, signum)
+
+    app.socketio.start_background_task(wait_for_signal)
+    logger.info(
+        f"Serving on {host}:{port} with {args.async_mode} (up to {args.connections} connections, "
+        f"{args.blocking_threads} blocking-call threads)"
+    )
+    try:
+        app.socketio.run(app.app, host=host, port=port, debug=False, use_reloader=False, **options)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    logger.info('Server stopped accepting connections, flushing pending work')
+    app.shutdown(timeout=args.graceful_timeout)
+    logger.info('Shutdown complete')
+
+def supervise(args):
+    # One process per port; crashed workers are restarted, SIGTERM/SIGINT is passed on to all
+    if not os.getenv('SOCKETIO_MESSAGE_QUEUE'):
+        sys.exit('--workers > 1 needs SOCKETIO_MESSAGE_QUEUE so the workers can reach each other\'s sockets')
+
+    # Imported here rather than at the top: subprocess imports threading, which a worker must only
+    # import after patch()
+    import logging
+    import subprocess
+    import logs
+
+    logs.setup(level=os.getenv('LOG_LEVEL', 'INFO').upper(), fmt=os.getenv('LOG_FORMAT', 'text'))
+    logger = logging.getLogger('server')
+    host, port = parse_bind(args.bind)
+
+    def spawn(index):
+        command = [
+            sys.executable, os.path.abspath(__file__), '--workers', '1',
+            '--bind', f"{host}:{port + index}", '--async-mode', args.async_mode,
+            '--connections', str(args.connections), '--blocking-threads', str(args.blocking_threads),
+            '--graceful-timeout', str(args.graceful_timeout)
+        ]
+        if args.access_log:
+            command.append('--access-log')
+        logger.info(f"Starting worker {index} on {host}:{port + index}")
+        return subprocess.Popen(command)
+
+    stopping = []
+
+    def request_shutdown(signum, frame):
+        if not stopping:
+            logger.info(f"Received {signal.Signals(signum).name}, stopping {len(workers)} workers")
+        stopping.append(signum)
+        for process in workers.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+
+    workers = {index: spawn(index) for index in range(args.workers)}
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    while workers:
+        time.sleep(0.5)
+        for index, process in list(workers.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            if stopping:
+                del workers[index]
+            else:
+                logger.error(f"Worker {index} exited with status {code}, restarting it")
+                time.sleep(1)
+                workers[index] = spawn(index)
+    logs.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the app on an asynchronous production server')
+    parser.add_argument('--bind', default=os.getenv('SERVER_BIND', '0.0.0.0:5008'), help='host:port to listen on')
+    parser.add_argument('--async-mode', choices=ASYNC_MODES, default=os.getenv('SERVER_ASYNC_MODE', 'eventlet'))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SERVER_WORKERS', '1')),
+                        help='processes, on consecutive ports starting at the bound one')
+    parser.add_argument('--connections', type=int, default=int(os.getenv('SERVER_CONNECTIONS', '1000')),
+                        help='concurrent connections (greenlets) per worker')
+    parser.add_argument('--blocking-threads', type=int, default=int(os.getenv('SERVER_BLOCKING_THREADS', '20')),
+                        help='OS threads per worker for SQLite calls')
+    parser.add_argument('--graceful-timeout', type=float, default=float(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30')),
+                        help='seconds requests and generation jobs get to finish on shutdown')
+    parser.add_argument('--access-log', action='store_true', default=os.getenv('SERVER_ACCESS_LOG') == '1')
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        supervise(args)
+    else:
+        serve(args)
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,8 @@ fetch('/pusher-config')
 
         let editor;
         let currentRoom;
+        // Identifies this tab in batched room updates so it can skip its own code and cursor
+        const clientId = Math.random().toString(36).slice(2, 10);
 
         document.addEventListener('DOMContentLoaded', function() {
             // Initialize CodeMirror
@@ -30,19 +32,25 @@ fetch('/pusher-config')
             // Subscribe to the room channel
             const channel = pusher.subscribe(`room-${currentRoom}`);
 
-            // Handle incoming code updates
-            channel.bind('code-update', function(data) {
-                const currentCursor = editor.getCursor();
-                editor.setValue(data.code);
-                editor.setCursor(currentCursor);
-                
-                if (data.language) {
-                    updateEditorMode(data.language);
-                }
+            // Handle batched room updates: latest code plus the latest cursor of each participant
+            channel.bind('room-update', function(data) {
+                if (data.sender !== clientId) {
+                    if (typeof data.code === 'string') {
+                        const currentCursor = editor.getCursor();
+                        editor.setValue(data.code);
+                        editor.setCursor(currentCursor);
+                    }
 
-                if (data.cursor) {
-                    showRemoteCursor(data.cursor);
+                    if (data.language) {
+                        updateEditorMode(data.language);
+                    }
                 }
+
+                Object.entries(data.participants || {}).forEach(([participant, state]) => {
+                    if (participant !== clientId && state.cursor) {
+                        showRemoteCursor(state.cursor);
+                    }
+                });
             });
 
             // Handle local changes
@@ -65,9 +73,7 @@ fetch('/pusher-config')
                 if (!currentRoom) return;
 
                 sendUpdate({
-                    cursor: cm.getCursor(),
-                    code: cm.getValue(),
-                    language: cm.getMode().name
+                    cursor: cm.getCursor()
                 });
             });
 
@@ -265,7 +271,7 @@ fetch('/pusher-config')
                     headers: {
                         'Content-Type': 'application/json'
                     },
-                    body: JSON.stringify(data)
+                    body: JSON.stringify({ ...data, clientId })
                 }).catch(console.error);
             }
 
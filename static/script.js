@@ -62,6 +62,54 @@ document.addEventListener('DOMContentLoaded', function() {
         status.textContent = loading ? 'Generating code...' : '';
     }
 
+    // Format explanation / future steps text into list markup
+    function renderSteps(elementId, className, text) {
+        const formatted = (text || '').split('\n').map(line => {
+            line = line.trim();
+            if (line.startsWith('- ')) {
+                return `<li class="mb-2">${line.substring(2)}</li>`;
+            } else if (line.match(/^\d+\./)) {
+                return `<li class="mb-2">${line}</li>`;
+            } else if (line.length > 0) {
+                return `<p class="mb-3">${line}</p>`;
+            }
+            return '';
+        }).join('');
+        document.getElementById(elementId).innerHTML = `<div class="${className}">${formatted}</div>`;
+    }
+
+    // Parse a Server-Sent Events stream from a fetch response
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        event = line.substring(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.substring(5).trim();
+                    }
+                });
+                if (data) {
+                    onEvent(event, JSON.parse(data));
+                }
+            }
+        }
+    }
+
     // Generate code
     window.generateCode = async function() {
         try {
@@ -74,7 +122,7 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             
             showLoading('wave');
-            const response = await fetch('/generate', {
+            const response = await fetch('/generate/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -82,43 +130,44 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({ prompt, language })
             });
             
-            const data = await response.json();
-            
             if (!response.ok) {
+                const data = await response.json();
                 throw new Error(data.error || 'Failed to generate code');
             }
             
-            editor.setValue(data.code);
-            
-            // Format and update explanation
-            const explanation = data.explanation || '';
-            const formattedExplanation = explanation.split('\n').map(line => {
-                line = line.trim();
-                if (line.startsWith('- ')) {
-                    return `<li class="mb-2">${line.substring(2)}</li>`;
-                } else if (line.match(/^\d+\./)) {
-                    return `<li class="mb-2">${line}</li>`;
-                } else if (line.length > 0) {
-                    return `<p class="mb-3">${line}</p>`;
-                }
-                return '';
-            }).join('');
-            document.getElementById('code-explanation').innerHTML = `<div class="explanation-content">${formattedExplanation}</div>`;
-            
-            // Format and update future steps
-            const futureSteps = data.futureSteps || '';
-            const formattedSteps = futureSteps.split('\n').map(line => {
-                line = line.trim();
-                if (line.startsWith('- ')) {
-                    return `<li class="mb-2">${line.substring(2)}</li>`;
-                } else if (line.match(/^\d+\./)) {
-                    return `<li class="mb-2">${line}</li>`;
-                } else if (line.length > 0) {
-                    return `<p class="mb-3">${line}</p>`;
+            let code = '';
+            const streamed = { explanation: '', futureSteps: '' };
+            editor.setValue('');
+            renderSteps('code-explanation', 'explanation-content', '');
+            renderSteps('future-prediction', 'future-steps-content', '');
+            
+            await readEventStream(response, (event, data) => {
+                switch (event) {
+                    case 'code':
+                        // First token is here, the loader has done its job
+                        hideLoading();
+                        code += data.delta;
+                        editor.setValue(code);
+                        break;
+                    case 'code_done':
+                        editor.setValue(data.code);
+                        break;
+                    case 'explanation':
+                    case 'futureSteps':
+                        streamed[event] += data.delta;
+                        break;
+                    case 'explanation_done':
+                        streamed.explanation = data.explanation;
+                        break;
+                    case 'futureSteps_done':
+                        streamed.futureSteps = data.futureSteps;
+                        break;
+                    case 'error':
+                        throw new Error(data.error || 'Failed to generate code');
                 }
-                return '';
-            }).join('');
-            document.getElementById('future-prediction').innerHTML = `<div class="future-steps-content">${formattedSteps}</div>`;
+                renderSteps('code-explanation', 'explanation-content', streamed.explanation);
+                renderSteps('future-prediction', 'future-steps-content', streamed.futureSteps);
+            });
             
         } catch (error) {
             console.error('Error:', error);
@@ -129,7 +178,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Analyze code
-    async function analyzeCode(code) {
+    async function analyzeCode(code, language = 'python') {
         showLoading('pulse');
         try {
             const response = await fetch('/analyze', {
@@ -137,7 +186,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({ code })
+                body: JSON.stringify({ code, language })
             });
             
             if (!response.ok) {
@@ -285,6 +334,53 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Function to load history
+    function renderHistoryItems(historyList, items) {
+        items.forEach(item => {
+            const historyItem = document.createElement('div');
+            historyItem.className = 'history-item p-3 border-bottom';
+            historyItem.innerHTML = `
+                <div class="d-flex justify-content-between align-items-start">
+                    <div class="flex-grow-1">
+                        <div class="d-flex justify-content-between">
+                            <h6 class="mb-1">Language: ${item.language}</h6>
+                            <small class="text-muted">${new Date(item.created_at).toLocaleString()}</small>
+                        </div>
+                        <p class="mb-2 text-wrap">${item.prompt}</p>
+                        <button class="btn btn-sm btn-outline-primary" onclick="loadHistoryItem('${item.id}')">
+                            Load Code
+                        </button>
+                    </div>
+                </div>
+            `;
+            historyList.appendChild(historyItem);
+        });
+    }
+
+    // Appends a 'Load more' button that fetches the next page from url and renders it with renderItems
+    function renderLoadMore(list, url, nextCursor, itemsKey, renderItems, label) {
+        if (!nextCursor) return;
+        const loadMore = document.createElement('button');
+        loadMore.className = 'btn btn-sm btn-outline-secondary w-100 mt-2';
+        loadMore.textContent = 'Load more';
+        loadMore.addEventListener('click', async () => {
+            loadMore.disabled = true;
+            try {
+                const response = await fetch(`${url}?cursor=${encodeURIComponent(nextCursor)}`);
+                const data = await response.json();
+                if (!response.ok) {
+                    throw new Error(data.error || `Failed to load ${label}`);
+                }
+                loadMore.remove();
+                renderItems(list, data[itemsKey]);
+                renderLoadMore(list, url, data.nextCursor, itemsKey, renderItems, label);
+            } catch (error) {
+                loadMore.disabled = false;
+                alert(`Error loading ${label}: ` + error.message);
+            }
+        });
+        list.appendChild(loadMore);
+    }
+
     window.loadHistory = async function() {
         try {
             showLoading('pulse');
@@ -307,25 +403,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
             
-            data.history.forEach(item => {
-                const historyItem = document.createElement('div');
-                historyItem.className = 'history-item p-3 border-bottom';
-                historyItem.innerHTML = `
-                    <div class="d-flex justify-content-between align-items-start">
-                        <div class="flex-grow-1">
-                            <div class="d-flex justify-content-between">
-                                <h6 class="mb-1">Language: ${item.language}</h6>
-                                <small class="text-muted">${new Date(item.timestamp).toLocaleString()}</small>
-                            </div>
-                            <p class="mb-2 text-wrap">${item.prompt}</p>
-                            <button class="btn btn-sm btn-outline-primary" onclick="loadHistoryItem('${item.id}')">
-                                Load Code
-                            </button>
-                        </div>
-                    </div>
-                `;
-                historyList.appendChild(historyItem);
-            });
+            renderHistoryItems(historyList, data.history);
+            renderLoadMore(historyList, '/history', data.nextCursor, 'history', renderHistoryItems, 'history');
             
             const historyModal = new bootstrap.Modal(document.getElementById('historyModal'));
             historyModal.show();
@@ -379,6 +458,26 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Function to load snippets
+    function renderSnippetItems(snippetsList, snippets) {
+        snippets.forEach(snippet => {
+            const snippetItem = document.createElement('div');
+            snippetItem.className = 'list-group-item';
+            snippetItem.innerHTML = `
+                <div class="d-flex justify-content-between align-items-start">
+                    <div>
+                        <h6 class="mb-1">${snippet.title}</h6>
+                        <p class="mb-1">${snippet.description || ''}</p>
+                        <small class="text-muted">Language: ${snippet.language} | Created: ${new Date(snippet.created_at).toLocaleString()}</small>
+                    </div>
+                    <button class="btn btn-sm btn-outline-primary" onclick="loadSnippet(${snippet.id})">
+                        Load
+                    </button>
+                </div>
+            `;
+            snippetsList.appendChild(snippetItem);
+        });
+    }
+
     async function loadSnippets() {
         try {
             const response = await fetch('/api/snippets');
@@ -391,23 +490,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const snippetsList = document.getElementById('snippets-list');
             snippetsList.innerHTML = '';
             
-            data.snippets.forEach(snippet => {
-                const snippetItem = document.createElement('div');
-                snippetItem.className = 'list-group-item';
-                snippetItem.innerHTML = `
-                    <div class="d-flex justify-content-between align-items-start">
-                        <div>
-                            <h6 class="mb-1">${snippet.title}</h6>
-                            <p class="mb-1">${snippet.description || ''}</p>
-                            <small class="text-muted">Language: ${snippet.language} | Created: ${new Date(snippet.timestamp).toLocaleString()}</small>
-                        </div>
-                        <button class="btn btn-sm btn-outline-primary" onclick="loadSnippet(${snippet.id})">
-                            Load
-                        </button>
-                    </div>
-                `;
-                snippetsList.appendChild(snippetItem);
-            });
+            renderSnippetItems(snippetsList, data.snippets);
+            renderLoadMore(snippetsList, '/api/snippets', data.nextCursor, 'snippets', renderSnippetItems, 'snippets');
             
             const modal = new bootstrap.Modal(document.getElementById('snippets-modal'));
             modal.show();
@@ -420,11 +504,11 @@ document.addEventListener('DOMContentLoaded', function() {
     // Function to load a specific snippet
     async function loadSnippet(snippetId) {
         try {
-            const snippets = (await (await fetch('/api/snippets')).json()).snippets;
-            const snippet = snippets.find(s => s.id === snippetId);
+            const response = await fetch(`/api/snippets/${snippetId}`);
+            const snippet = await response.json();
             
-            if (!snippet) {
-                throw new Error('Snippet not found');
+            if (!response.ok) {
+                throw new Error(snippet.error || 'Snippet not found');
             }
             
             editor.setValue(snippet.code);